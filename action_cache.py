@@ -0,0 +1,207 @@
+# A local cache of the outputs of link and archive commands, used by edge_launcher.py --cache.
+#
+# An entry is keyed on the command line, with any @rsp files expanded, and the contents of every
+# file it names, including the tool itself, -l libraries found in its -L directories and the
+# members of thin archives. Inputs that the command finds some other way, such as the linker the
+# compiler driver runs or system libraries, aren't part of the key.
+#
+# The cache directory holds the outputs under objects/ and an sqlite database with the size and
+# last use of each entry, for evicting the least recently used ones when it grows past its
+# limit, and the hashes of the inputs by inode, size and mtime so that each is only read when it
+# changes. Entries are read-only and restored as a reflink where the filesystem supports them,
+# otherwise as a hardlink if the entry is newer than the inputs, so a hit rarely copies anything.
+
+import hashlib
+import os
+import shlex
+import shutil
+import sqlite3
+import time
+
+from install_file import clone
+
+KEY_VERSION = b'1'
+# Like git's racily clean files, a hash is only remembered once the file's mtime is far enough in
+# the past that another write couldn't leave it with the same mtime.
+RACY_SECONDS = 1
+
+def parse_size(size):
+    """Returns the number of bytes in a size like 500M or 20G."""
+    units = dict(K=1 << 10, M=1 << 20, G=1 << 30, T=1 << 40)
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+def expand_args(cmd):
+    """Returns cmd with each @file argument replaced by the arguments in that file."""
+    args = []
+    for arg in cmd:
+        if arg.startswith('@') and os.path.isfile(arg[1:]):
+            with open(arg[1:]) as f:
+                args += shlex.split(f.read())
+        else:
+            args.append(arg)
+    return args
+
+def thin_archive_members(path):
+    """Returns the paths of the members of a thin archive, or [] if path isn't one.
+
+    A thin archive only holds the paths of its members, so it doesn't change when they do.
+    """
+    with open(path, 'rb') as f:
+        if f.read(8) != b'!<thin>\n':
+            return []
+        data = f.read()
+    members = []
+    long_names = b''
+    offset = 0
+    while offset + 60 <= len(data):
+        name = data[offset:offset + 16].rstrip(b' ')
+        size = int(data[offset + 48:offset + 58])
+        offset += 60
+        # Only the symbol table and the table of long names are stored in the archive.
+        if name in (b'/', b'/SYM64/'):
+            offset += size + size % 2
+        elif name == b'//':
+            long_names = data[offset:offset + size]
+            offset += size + size % 2
+        else:
+            if name.startswith(b'/'):
+                start = int(name[1:])
+                name = long_names[start:long_names.index(b'/\n', start)]
+            members.append(os.path.join(os.path.dirname(path),
+                                        name.rstrip(b'/').decode('utf8')))
+    return members
+
+def input_files(args, output):
+    """Returns the existing files named by args, other than output, in order.
+
+    The members of thin archives are included after the archives.
+    """
+    search_dirs = [arg[2:] for arg in args if arg.startswith('-L') and len(arg) > 2]
+    files = []
+    tool = shutil.which(args[0]) if args else None
+    if tool:
+        files.append(tool)
+    for arg in args[1:]:
+        candidates = [arg]
+        if arg.startswith('-l') and len(arg) > 2:
+            candidates = [c for d in search_dirs for c in (
+                os.path.join(d, 'lib%s.so' % arg[2:]), os.path.join(d, 'lib%s.a' % arg[2:]))]
+        elif arg.startswith('-'):
+            # Things like -Wl,--version-script=file.
+            candidates = arg.replace('=', ',').split(',')[1:]
+        for candidate in candidates:
+            if candidate != output and os.path.isfile(candidate):
+                files.append(candidate)
+                files += [m for m in thin_archive_members(candidate) if os.path.isfile(m)]
+                break
+    return files
+
+class ActionCache(object):
+    def __init__(self, cache_dir, max_size):
+        self.dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, ino INTEGER,'
+                            ' size INTEGER, mtime_ns INTEGER, hash TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY,'
+                            ' size INTEGER, used REAL)')
+
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute('SELECT hash FROM hashes WHERE path=? AND ino=? AND size=?'
+                              ' AND mtime_ns=?', (path, st.st_ino, st.st_size, st.st_mtime_ns))
+        row = row.fetchone()
+        if row:
+            return row[0]
+
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        if st.st_mtime_ns < (time.time() - RACY_SECONDS) * 1e9:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                                (path, st.st_ino, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def key(self, cmd, output):
+        """Returns the key for cmd and the newest mtime of the files it was computed from."""
+        args = expand_args(cmd)
+        h = hashlib.sha1(KEY_VERSION)
+        for arg in args:
+            h.update(arg.encode('utf8') + b'\0')
+        newest_input = 0
+        for path in input_files(args, output):
+            h.update(('%s\0%s\0' % (path, self.file_hash(path))).encode('utf8'))
+            newest_input = max(newest_input, os.stat(path).st_mtime_ns)
+        return h.hexdigest(), newest_input
+
+    def path(self, key):
+        return os.path.join(self.dir, 'objects', key[:2], key)
+
+    def restore(self, key, output, newest_input):
+        """Puts the cached output for key in place, returning False if there isn't one.
+
+        Ninja compares the output's mtime to newest_input the next time it runs.
+        """
+        entry = self.path(key)
+        if os.path.exists(output):
+            os.remove(output)
+        try:
+            if clone(entry, output):
+                os.chmod(output, os.stat(entry).st_mode | 0o200)
+                os.utime(output)
+            elif os.stat(entry).st_mtime_ns >= newest_input:
+                os.link(entry, output)
+            else:
+                # Touching a hardlink would touch the entry and every other output linked to it.
+                shutil.copyfile(entry, output)
+                os.chmod(output, os.stat(entry).st_mode | 0o200)
+        except OSError:
+            # Missing, or evicted while this was restoring it.
+            if os.path.exists(output):
+                os.remove(output)
+            return False
+        with self.db:
+            self.db.execute('UPDATE entries SET used=? WHERE key=?', (time.time(), key))
+        return True
+
+    def store(self, key, output):
+        entry = self.path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = '%s.%d.tmp' % (entry, os.getpid())
+        if not clone(output, tmp):
+            shutil.copyfile(output, tmp)
+        # Read-only, since restoring it may hardlink it into the build.
+        os.chmod(tmp, os.stat(output).st_mode & 0o555)
+        os.replace(tmp, entry)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                            (key, os.stat(entry).st_size, time.time()))
+        self.evict()
+
+    def evict(self):
+        with self.db:
+            total = self.db.execute('SELECT TOTAL(size) FROM entries').fetchone()[0]
+            if total <= self.max_size:
+                return
+            evicted = []
+            for key, size in self.db.execute('SELECT key, size FROM entries ORDER BY used'):
+                if total <= self.max_size * 0.9: # Leave some room so this doesn't run every time.
+                    break
+                evicted.append(key)
+                total -= size
+            self.db.executemany('DELETE FROM entries WHERE key=?', [(k,) for k in evicted])
+        for key in evicted:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
@@ -0,0 +1,231 @@
+# Builds a mongo-shaped graph of fake SCons nodes for ninja_gen_bench.py: libraries of C++
+# compiles with some C and IDL sources, archives or shared libraries depending on the link model,
+# programs and tests every few libraries with their installs, substituted headers and the
+# FunctionActions that build.py translates or leaves to scons.
+
+import types
+
+import fake_scons as fs
+
+class Builder(object):
+    def __init__(self, action):
+        self.action = action
+
+class Executor(object):
+    def __init__(self, action, env, targets, sources):
+        self.action_list = [action]
+        self.post_actions = []
+        self.overridelist = []
+        self.env = env
+        self.targets = targets
+        self.sources = sources
+
+    def __str__(self):
+        return '\n'.join(str(a) for a in self.action_list)
+
+    def get_action_list(self):
+        return self.action_list
+
+    def set_action_list(self, actions):
+        self.action_list = actions if isinstance(actions, list) else [actions]
+
+    def get_build_env(self):
+        return self.env
+
+    def get_all_targets(self):
+        return self.targets
+
+    def get_all_sources(self):
+        return self.sources
+
+    def get_all_children(self):
+        return self.sources
+
+class Node(fs.File):
+    def __init__(self, path):
+        self.path = path
+        self.builder = None
+        self.executor = None
+        self.depends = []
+        self.implicit = []
+        self.sources = []
+        self.side_effect = False
+        self.side_effects = []
+        self.always_build = False
+
+    def __str__(self):
+        return self.path
+
+    def get_path(self):
+        return self.path
+
+    def srcnode(self):
+        return self
+
+    def stat(self):
+        return None if self.builder else True
+
+    def has_builder(self):
+        return self.builder is not None
+
+    def children(self):
+        return self.sources + self.depends
+
+    def scan(self):
+        pass
+
+class Graph(object):
+    def __init__(self, env):
+        self.env = env
+        self.nodes = {}
+        self.aliases = []
+
+    def node(self, path):
+        if path not in self.nodes:
+            self.nodes[path] = Node(path)
+        return self.nodes[path]
+
+    def build(self, targets, sources, action, env=None):
+        targets = [self.node(t) for t in targets]
+        sources = [s if isinstance(s, fs.Value) else self.node(s) for s in sources]
+        executor = Executor(action, env or self.env, targets, sources)
+        for t in targets:
+            t.builder = Builder(action)
+            t.executor = executor
+            t.sources = [s for s in sources if isinstance(s, Node)]
+        return targets
+
+def make_env(link_model, icecream=False, ccache=False):
+    libdeps = {}
+    def get_libs(sources, targets, env, for_signature):
+        return libdeps.get(str(targets[0]), [])
+    variables = dict(
+        CC='gcc', CXX='g++', SHCC='$CC', SHCXX='$CXX', LINK='$CXX', SHLINK='$LINK', AR='ar',
+        PYTHON='python3', IDLC='$PYTHON buildscripts/idl/idlc.py', VARIANT_DIR='ninja',
+        CCFLAGS=['-g', '-O2', '-Wall', '-fno-omit-frame-pointer'], CFLAGS=[],
+        CXXFLAGS=['-std=c++17', '-Woverloaded-virtual'],
+        SHCCFLAGS='$CCFLAGS -fPIC', SHCXXFLAGS='$CXXFLAGS',
+        _CCCOMCOM='-Isrc -Ibuild/ninja -DMONGO_CONFIG_DEBUG_BUILD',
+        LINKFLAGS=['-pthread', '-Wl,--fatal-warnings'], SHLINKFLAGS='$LINKFLAGS -shared',
+        ARFLAGS='rcsTD', _LIBDIRFLAGS='', __RPATH='', __SHLIBVERSIONFLAGS='',
+        _LIBDEPS='$_LIBDEPS_OBJS' if link_model == 'object' else '$_LIBDEPS_GET_LIBS',
+        _LIBDEPS_GET_LIBS=get_libs, _LIBDEPS_OBJS=get_libs,
+        _LIBFLAGS='-Wl,--start-group $_LIBDEPS -Wl,--end-group -lm -lresolv',
+        NINJA='/usr/bin/ninja', MONGO_VERSION='0.0.0', MONGO_GIT_HASH='unknown',
+        IDL_HAS_INLINE_DEPENDENCIES=True,
+        )
+    if ccache:
+        variables['_NINJA_CCACHE'] = '/usr/bin/ccache'
+        variables['_NINJA_CCACHE_VERSION'] = [4, 8, 0]
+    if icecream:
+        variables['_NINJA_ICECC'] = '/usr/bin/icecc'
+        variables['_NINJA_ICERUN'] = '/usr/bin/icerun'
+    tools = {'gcc': '/usr/bin/gcc', 'g++': '/usr/bin/g++', 'ar': '/usr/bin/ar',
+             'python3': '/usr/bin/python3'}
+    env = fs.Env(variables, tools)
+    env.libdeps = libdeps
+    return env
+
+def derive(env, **overrides):
+    child = fs.Env(dict(env.vars), env.tools, env.os_name, env.toolchain)
+    child.vars.update(overrides)
+    child.fs = env.fs
+    return child
+
+CXX = '$CXX -o $TARGET -c $CXXFLAGS $CCFLAGS $_CCCOMCOM $SOURCES'
+SHCXX = '$SHCXX -o $TARGET -c $SHCXXFLAGS $SHCCFLAGS $_CCCOMCOM $SOURCES'
+CC = '$CC -o $TARGET -c $CFLAGS $CCFLAGS $_CCCOMCOM $SOURCES'
+AR = '$AR $ARFLAGS $TARGET $SOURCES'
+LINK = '$LINK -o $TARGET $LINKFLAGS $__RPATH $SOURCES $_LIBDIRFLAGS $_LIBFLAGS'
+SHLINK = ('$SHLINK -o $TARGET $SHLINKFLAGS $__SHLIBVERSIONFLAGS $__RPATH $SOURCES $_LIBDIRFLAGS'
+          ' $_LIBFLAGS')
+
+def make_graph(edges, link_model='static', icecream=False, ccache=False, files_per_lib=20):
+    """Returns the environment and a Graph with roughly edges build edges."""
+    import SCons
+    env = make_env(link_model, icecream, ccache)
+    graph = Graph(env)
+    env.fs = types.SimpleNamespace(Top=types.SimpleNamespace(root=types.SimpleNamespace(
+        _lookupDict=graph.nodes)))
+    shared = link_model == 'dynamic'
+    obj_suffix = 'os' if shared else 'o'
+    compile_cmd = SHCXX if shared else CXX
+    libs = []
+    aliases = {'install-core': [], 'unittests': []}
+    for i in range(max(1, edges // (files_per_lib + 3))):
+        d = 'src/mongo/lib%d' % i
+        bd = 'build/ninja/mongo/lib%d' % i
+        lib_env = derive(env, _CCCOMCOM=env['_CCCOMCOM'] + (' -DLIB_%d' % (i % 7)))
+        objs = []
+        for j in range(files_per_lib):
+            src = '%s/file%d.cpp' % (d, j)
+            obj = '%s/file%d.%s' % (bd, j, obj_suffix)
+            if j == 0 and i % 5 == 0:
+                idl = '%s/idl%d.idl' % (d, i)
+                src, header = '%s/idl%d_gen.cpp' % (bd, i), '%s/idl%d_gen.h' % (bd, i)
+                graph.build([src, header], [idl], fs.CommandAction(
+                    '$IDLC --header ${TARGETS[1]} --output ${TARGETS[0]} $SOURCES'), lib_env)
+            if j == 1 and i % 3 == 0:
+                src = '%s/file%d.c' % (d, j)
+                graph.build([obj], [src], fs.CommandAction(
+                    CC.replace('$CC', '$SHCC' if shared else '$CC')), lib_env)
+            else:
+                graph.build([obj], [src], fs.CommandAction(compile_cmd), lib_env)
+            objs.append(obj)
+
+        if i % 10 == 5:
+            graph.build(['%s/copied%d.js' % (bd, i)], ['%s/orig%d.js' % (d, i)],
+                        SCons.Defaults.Copy('$TARGET', '$SOURCE'), lib_env)
+            graph.build(['%s/text%d.h' % (bd, i)],
+                        [fs.Value('#define A "@A@"'), fs.Value('#define B %d' % i)],
+                        fs.TEXT_ACTION, derive(lib_env, SUBST_DICT={'@A@': 'x' * i}))
+            graph.build(['%s/stamp%d' % (bd, i)], [], SCons.Defaults.Touch('$TARGET'), lib_env)
+            graph.build(['%s/func%d.cpp' % (bd, i)], ['%s/func%d.in' % (d, i)],
+                        fs.FunctionAction('generate_func'), lib_env)
+            graph.build(['%s/func%d_chained.cpp' % (bd, i)], ['%s/func%d.cpp' % (bd, i)],
+                        fs.FunctionAction('generate_func'), lib_env)
+        if i % 10 == 0:
+            graph.build(['%s/config%d.h' % (bd, i)], ['%s/config%d.h.in' % (d, i)],
+                        fs.SUBST_ACTION,
+                        derive(lib_env, SUBST_DICT={'@VERSION@': '1.0', '@NAME@': 'lib%d' % i}))
+            if i % 20 == 0:
+                graph.build(['%s/config%d_chained.h' % (bd, i)], ['%s/config%d.h' % (bd, i)],
+                            fs.SUBST_ACTION, derive(lib_env, SUBST_DICT={'1.0': '2.0'}))
+
+        lib = None
+        if shared:
+            lib = '%s/liblib%d.so' % (bd, i)
+            graph.build([lib], objs, fs.ListAction([
+                fs.FunctionAction('SharedFlagChecker'), fs.CommandAction(SHLINK),
+                fs.FunctionAction('LibSymlinksActionFunction')]), lib_env)
+        elif link_model != 'object':
+            lib = '%s/liblib%d.a' % (bd, i)
+            graph.build([lib], objs, fs.CommandAction(AR), lib_env)
+        libs.append(lib or objs)
+        deps = fs.flatten([libs[k] for k in range(max(0, i - 8), i)])
+        if shared:
+            env.libdeps[lib] = deps
+
+        # A program or a test every few libraries.
+        if i % 4 == 3:
+            is_test = i % 8 == 7
+            name = 'lib%d_%s' % (i, 'test' if is_test else 'prog')
+            prog = '%s/%s' % (bd, name)
+            main = '%s/%s_main.%s' % (bd, name, obj_suffix)
+            graph.build([main], ['%s/%s_main.cpp' % (d, name)], fs.CommandAction(compile_cmd),
+                        lib_env)
+            env.libdeps[prog] = fs.flatten([libs[i]]) + deps
+            graph.build([prog], [main] + (objs if link_model == 'object' else []),
+                        fs.CommandAction(LINK), lib_env)
+            dest = 'build/%s/%s' % ('unittests' if is_test else 'install/bin', name)
+            graph.build([dest], [prog], SCons.Tool.install.install_action, lib_env)
+            aliases['unittests' if is_test else 'install-core'].append(dest)
+
+    graph.build(['build/unittests.txt'], [fs.Value(aliases['unittests'])],
+                fs.FunctionAction('write_test_list'), env)
+    graph.build(['build/ninja/mongo/generated_version.cpp'], ['src/mongo/version.tpl'],
+                fs.FunctionAction('generate_version_file'), env)
+    graph.build(['compile_commands.json'], [], fs.FunctionAction('write_compdb'), env)
+    graph.aliases = [fs.Alias(name, [graph.node(s) for s in sources])
+                     for name, sources in sorted(aliases.items())]
+    return env, graph
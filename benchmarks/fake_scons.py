@@ -0,0 +1,246 @@
+# Just enough of SCons for build.py to generate a build.ninja from the graph in fake_graph.py,
+# without a mongo checkout. install() must run before build.py is imported.
+
+import re
+import sys
+import types
+
+# What GetOption returns, by dest, for the options that aren't left at their defaults.
+options = {}
+# The default and type of each option by dest, which AddOption records when build.add_options
+# runs. cache and cache_disable come from mongo's SConstruct.
+defaults = {'cache': None, 'cache_disable': False}
+types_by_dest = {}
+
+def AddOption(*names, **kwargs):
+    defaults[kwargs['dest']] = kwargs.get('default')
+    types_by_dest[kwargs['dest']] = kwargs.get('type')
+
+def GetOption(name):
+    return options[name] if name in options else defaults[name]
+
+def set_option(name, value):
+    """Sets an option by dest like scons would from the command line, where value is True for
+    flags. Raises ValueError for options nothing declared."""
+    if name not in defaults:
+        raise ValueError('unknown option %s, options are named by their dest: %s' % (
+            name, ', '.join(sorted(defaults))))
+    if types_by_dest.get(name) == 'int' and value is not True:
+        value = int(value)
+    options[name] = value
+
+def flatten(seq):
+    out = []
+    for item in seq:
+        if isinstance(item, (list, tuple)):
+            out.extend(flatten(item))
+        else:
+            out.append(item)
+    return out
+
+class CommandAction(object):
+    def __init__(self, cmd):
+        self.cmd = cmd
+
+    def __str__(self):
+        return self.cmd
+
+class CommandGeneratorAction(CommandAction):
+    pass
+
+class FunctionAction(object):
+    def __init__(self, name, args='target, source, env'):
+        self.name = name
+        self.args = args
+
+    def __str__(self):
+        return '%s(%s)' % (self.name, self.args)
+
+class ListAction(object):
+    def __init__(self, actions):
+        self.list = actions
+
+    def __str__(self):
+        return '\n'.join(str(a) for a in self.list)
+
+def Action(cmd, *args, **kwargs):
+    if isinstance(cmd, (CommandAction, FunctionAction, ListAction)):
+        return cmd
+    return CommandAction(cmd)
+
+class Exit(Exception):
+    pass
+
+def exit(code=0):
+    raise Exit(code)
+
+class Base(object):
+    pass
+
+class Dir(Base):
+    pass
+
+class File(Base):
+    pass
+
+class Value(object):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+    def get_text_contents(self):
+        return str(self.value)
+
+class ActionFactory(object):
+    """Like SCons.Defaults.Copy and friends, which make FunctionActions calling an ActionCaller."""
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args, **kw):
+        action = FunctionAction(self.name, ', '.join('"%s"' % a for a in args))
+        action.execfunction = ActionCaller(self, args, kw)
+        return action
+
+class ActionCaller(object):
+    def __init__(self, parent, args, kw):
+        self.parent = parent
+        self.args = args
+        self.kw = kw
+
+    def subst_args(self, target, source, env):
+        return [arg.replace('$TARGET', str(target[0]))
+                   .replace('$SOURCE', str(source[0]) if source else '')
+                for arg in self.args]
+
+SUBST_ACTION = FunctionAction('_action')
+TEXT_ACTION = FunctionAction('_action')
+AliasBuilder = object()
+
+class Alias(object):
+    def __init__(self, name, sources):
+        self.name = name
+        self.sources = sources
+
+    def __str__(self):
+        return self.name
+
+    def has_builder(self):
+        return True
+
+    def get_builder(self):
+        return AliasBuilder
+
+def module(name):
+    mod = types.ModuleType(name)
+    sys.modules[name] = mod
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, mod)
+    return mod
+
+def install():
+    """Installs the fake SCons modules, returning SCons.Script."""
+    module('SCons')
+    script = module('SCons.Script')
+    util = module('SCons.Util')
+    node = module('SCons.Node')
+    fs = module('SCons.Node.FS')
+    alias = module('SCons.Node.Alias')
+    python = module('SCons.Node.Python')
+    action = module('SCons.Action')
+    module('SCons.Tool')
+    install_tool = module('SCons.Tool.install')
+    textfile = module('SCons.Tool.textfile')
+    environment = module('SCons.Environment')
+    defaults = module('SCons.Defaults')
+    module('buildscripts')
+    module('buildscripts.errorcodes')
+    module('requests')
+
+    util.flatten = flatten
+    util.is_List = lambda x: isinstance(x, (list, tuple))
+    node.is_derived_node = lambda n: getattr(n, 'builder', None) is not None
+    fs.Base = Base
+    fs.Dir = Dir
+    fs.File = File
+    alias.Alias = Alias
+    alias.default_ans = types.SimpleNamespace(values=lambda: [])
+    python.Value = Value
+    action.CommandAction = CommandAction
+    action.CommandGeneratorAction = CommandGeneratorAction
+    action.FunctionAction = FunctionAction
+    action.ListAction = ListAction
+    action.ActionCaller = ActionCaller
+    install_tool.install_action = FunctionAction('installFunc')
+    textfile._subst_builder = types.SimpleNamespace(action=SUBST_ACTION)
+    textfile._text_builder = types.SimpleNamespace(action=TEXT_ACTION)
+    environment.AliasBuilder = AliasBuilder
+    defaults.SharedFlagChecker = lambda *args: None
+    defaults.Copy = ActionFactory('Copy')
+    defaults.Mkdir = ActionFactory('Mkdir')
+    defaults.Touch = ActionFactory('Touch')
+
+    script.GetOption = GetOption
+    script.Exit = exit
+    script.Action = Action
+    script.COMMAND_LINE_TARGETS = []
+    script.BUILD_TARGETS = []
+    script.DEFAULT_TARGETS = []
+    script.__all__ = ['GetOption', 'Exit', 'Action', 'COMMAND_LINE_TARGETS', 'BUILD_TARGETS',
+                      'DEFAULT_TARGETS']
+    return script
+
+VAR_RE = re.compile(r'\$(\{[^}]*\}|\w+|\()')
+
+class Env(object):
+    """A construction environment that only knows about plain variables."""
+    def __init__(self, variables, tools, os_name='linux', toolchain='gcc'):
+        self.vars = variables
+        self.tools = tools
+        self.os_name = os_name
+        self.toolchain = toolchain
+        self.fs = None
+
+    def __getitem__(self, key):
+        return self.vars[key]
+
+    def __setitem__(self, key, value):
+        self.vars[key] = value
+
+    def __contains__(self, key):
+        return key in self.vars
+
+    def get(self, key, default=None):
+        return self.vars.get(key, default)
+
+    def AddOption(self, *names, **kwargs):
+        AddOption(*names, **kwargs)
+
+    def subst(self, s, executor=None, depth=0):
+        def replace(m):
+            name = m.group(1).strip('{}')
+            if name == '(':
+                return ''
+            value = self.vars.get(name, '')
+            if callable(value):
+                return ''
+            if isinstance(value, (list, tuple)):
+                value = ' '.join(str(v) for v in value)
+            return self.subst(str(value), executor, depth + 1) if depth < 10 else str(value)
+        return VAR_RE.sub(replace, s).replace('$)', '').strip()
+
+    def WhereIs(self, exe):
+        exe = self.subst(exe) if exe.startswith('$') else exe
+        if exe in self.tools:
+            return self.tools[exe]
+        if exe in self.vars:
+            return self.tools.get(self.vars[exe], '/usr/bin/' + str(self.vars[exe]))
+        return '/usr/bin/' + exe
+
+    def TargetOSIs(self, *names):
+        return self.os_name in names or ('posix' in names and self.os_name != 'windows')
+
+    def ToolchainIs(self, *names):
+        return self.toolchain in names
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# Measures generating build.ninja with NinjaFile from a synthetic mongo-shaped graph, so changes
+# to build.py can be measured without a mongo checkout or scons:
+#
+#   ninja_gen_bench.py [--edges 10000,50000] [--config static,dynamic,...]
+#                      [--option name[=value]...] [--ninja-version X.Y.Z]
+#                      [--save baseline.json | --check baseline.json] [--no-memory] [--keep]
+#
+# For each scale and config it reports the wall time of each phase, building the fake graph,
+# NinjaFile's constructor and writing the files, and the peak of the memory python had allocated
+# during it, plus the size of build.ninja and a hash of it. The hash ignores where the module is
+# checked out, so save a baseline before changing build.py and check against it after to prove
+# the output didn't change.
+#
+# Each measurement runs in its own process. Peak memory comes from tracemalloc, which slows things
+# down, so it is measured in a separate run from the times.
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+module_dir = os.path.dirname(my_dir)
+
+# The graph options for each config. --pch can't be combined with ccache or icecream.
+CONFIGS = {
+    'static': dict(link_model='static'),
+    'dynamic': dict(link_model='dynamic'),
+    'object': dict(link_model='object'),
+    'icecream': dict(link_model='static', icecream=True),
+    'ccache': dict(link_model='static', ccache=True),
+    'pch': dict(link_model='static', pch=True),
+}
+PHASES = ('graph', 'init', 'write')
+
+def output_hash(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    # The scripts build.ninja runs are named by their absolute paths.
+    return hashlib.sha256(data.replace(module_dir.encode('utf8'), b'$MODULE')).hexdigest()[:16]
+
+def import_build():
+    """Installs the fake SCons and imports build.py with its options declared. Returns the fake
+    SCons.Script and the fake_scons and build modules."""
+    sys.path.insert(0, my_dir)
+    import fake_scons
+    script = fake_scons.install()
+    sys.path.insert(0, module_dir)
+    # build.py puts the scons command line in build.ninja to regenerate it.
+    sys.argv = ['buildscripts/scons.py', 'build.ninja']
+    import build
+    build.add_options(fake_scons.Env({}, {}))
+    return script, fake_scons, build
+
+def run(spec):
+    """Generates build.ninja for spec in the current directory. Returns the results."""
+    script, fake_scons, build = import_build()
+    import fake_graph
+
+    config = CONFIGS[spec['config']]
+    fake_scons.options.update({'pch': config.get('pch', False), 'link-pool-depth': 4})
+    for name, value in spec['options'].items():
+        fake_scons.set_option(name, value)
+
+    tracing = spec['memory']
+    if tracing:
+        import tracemalloc
+        tracemalloc.start()
+    results = {}
+    def phase(name, func):
+        if tracing:
+            tracemalloc.reset_peak()
+        start = time.time()
+        value = func()
+        results[name + '_s'] = time.time() - start
+        if tracing:
+            results[name + '_mb'] = tracemalloc.get_traced_memory()[1] / float(1 << 20)
+        return value
+
+    env, graph = phase('graph', lambda: fake_graph.make_graph(
+        spec['edges'], config['link_model'], config.get('icecream', False),
+        config.get('ccache', False)))
+    env['_NINJA_VERSION'] = spec['ninja_version']
+    import SCons
+    SCons.Node.Alias.default_ans.values = lambda: graph.aliases
+    script.DEFAULT_TARGETS.append('install-core')
+
+    ninja_file = phase('init', lambda: build.NinjaFile('build.ninja', env))
+    phase('write', ninja_file.write)
+    results['size_mb'] = os.path.getsize('build.ninja') / float(1 << 20)
+    results['hash'] = output_hash('build.ninja')
+    return results
+
+def measure(spec, keep):
+    """Runs spec in a new process and temporary directory, returning its results."""
+    workdir = tempfile.mkdtemp(prefix='ninja_gen_bench')
+    try:
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--run',
+                                       json.dumps(spec)], cwd=workdir)
+    finally:
+        if keep:
+            print('Kept ' + workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return json.loads(out.decode('utf8').splitlines()[-1])
+
+def spec_name(spec):
+    version = spec['ninja_version']
+    version = ['ninja-%s' % '.'.join(map(str, version))] if version else []
+    return ' '.join(['%s/%d' % (spec['config'], spec['edges'])] + version +
+                    ['--%s%s' % (k, '' if v is True else '=%s' % v)
+                     for k, v in sorted(spec['options'].items())])
+
+def parse_args(args):
+    parsed = dict(edges=[10000], configs=sorted(CONFIGS), options={}, ninja_version=[],
+                  save=None, check=None, memory=True, keep=False)
+    while args:
+        flag = args.pop(0)
+        if flag == '--no-memory':
+            parsed['memory'] = False
+        elif flag == '--keep':
+            parsed['keep'] = True
+        elif not args:
+            return None
+        elif flag == '--edges':
+            parsed['edges'] = [int(e) for e in args.pop(0).split(',')]
+        elif flag == '--config':
+            parsed['configs'] = args.pop(0).split(',')
+            if not set(parsed['configs']) <= set(CONFIGS):
+                return None
+        elif flag == '--option':
+            name, _, value = args.pop(0).partition('=')
+            parsed['options'][name] = value or True
+        elif flag == '--ninja-version':
+            parsed['ninja_version'] = [int(part) for part in args.pop(0).split('.')]
+        elif flag in ('--save', '--check'):
+            parsed[flag[2:]] = args.pop(0)
+        else:
+            return None
+    return parsed
+
+def main(argv):
+    if len(argv) == 3 and argv[1] == '--run':
+        print(json.dumps(run(json.loads(argv[2]))))
+        return 0
+
+    args = parse_args(argv[1:])
+    if not args:
+        print(argv[0] + ': [--edges 10000,50000] [--config %s]' % ','.join(sorted(CONFIGS)))
+        print('    [--option name[=value]...] [--ninja-version X.Y.Z]')
+        print('    [--save baseline.json | --check baseline.json] [--no-memory] [--keep]')
+        return 1
+
+    # Checked here too so that a typo fails before any of the runs rather than in each of them.
+    _, fake_scons, _ = import_build()
+    try:
+        for name, value in args['options'].items():
+            fake_scons.set_option(name, value)
+    except ValueError as e:
+        print(argv[0] + ': ' + str(e))
+        return 1
+
+    baseline = {}
+    if args['check']:
+        with open(args['check']) as f:
+            baseline = json.load(f)
+
+    print('%-24s %8s %8s %8s %9s %9s %9s %9s  %s' % (
+        'config/edges', 'graph s', 'init s', 'write s', 'graph MB', 'init MB', 'write MB',
+        'output MB', 'hash'))
+    hashes = {}
+    failed = []
+    for edges in args['edges']:
+        for config in args['configs']:
+            spec = dict(config=config, edges=edges, options=args['options'],
+                        ninja_version=args['ninja_version'], memory=False)
+            results = measure(spec, args['keep'])
+            if args['memory']:
+                results.update((k, v) for k, v in measure(dict(spec, memory=True), False).items()
+                               if k.endswith('_mb') and k != 'size_mb')
+            name = spec_name(spec)
+            hashes[name] = results['hash']
+            print('%-24s %8.2f %8.2f %8.2f %9s %9s %9s %9.1f  %s' % tuple(
+                [name.split(' ')[0]] + [results[p + '_s'] for p in PHASES] +
+                ['%.1f' % results[p + '_mb'] if p + '_mb' in results else '-' for p in PHASES] +
+                [results['size_mb'], results['hash']]))
+            if name in baseline and baseline[name] != results['hash']:
+                failed.append(name)
+
+    if args['save']:
+        with open(args['save'], 'w') as f:
+            json.dump(hashes, f, indent=0, sort_keys=True)
+    if failed:
+        print('FAILED: build.ninja changed for ' + ', '.join(failed))
+        return 1
+    missing = [name for name in hashes if baseline and name not in baseline]
+    if missing:
+        print('Not in the baseline: ' + ', '.join(missing))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Compares running subst_file.py once per file, as the SCRIPT_RSP edges do, with a single
+# --batch run over the same files, as the SCRIPT_BATCH_RSP edge does. Both runs start with no
+# outputs, and the outputs must match.
+#
+# It also compares the single pass substitution engine with replacing each key in turn, as scons
+# does, on one large template.
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import subst_file
+
+subst_file_script = subst_file.__file__
+
+def make_jobs(root, files, keys):
+    jobs = []
+    for i in range(files):
+        subs = [['@KEY%d@' % k, 'value %d.%d' % (i, k)] for k in range(keys)]
+        template = os.path.join(root, 'in', 'file%d.h.in' % i)
+        with open(template, 'w') as f:
+            for line in range(200):
+                f.write('#define LINE%d "@KEY%d@"\n' % (line, line % keys))
+        jobs.append({'in': template, 'out': os.path.join(root, 'out', 'file%d.h' % i),
+                     'subs': subs, 'do_chmod': False})
+    return jobs
+
+def per_file(root, jobs):
+    for job in jobs:
+        rsp = job['out'] + '.rsp'
+        with open(rsp, 'w') as f:
+            json.dump(dict(subs=job['subs'], do_chmod=job['do_chmod']), f)
+        subprocess.check_call([sys.executable, subst_file_script, job['in'], job['out'], rsp])
+        os.remove(rsp)
+
+def batch(root, jobs):
+    rsp = os.path.join(root, 'batch.rsp')
+    with open(rsp, 'w') as f:
+        json.dump(jobs, f)
+    subprocess.check_call([sys.executable, subst_file_script, '--batch', rsp])
+
+def read_outputs(jobs):
+    outputs = []
+    for job in jobs:
+        with open(job['out']) as f:
+            outputs.append(f.read())
+    return outputs
+
+def sequential(contents, subs):
+    for k, v in subs:
+        contents = re.sub(k, v, contents)
+    return contents
+
+def compare_engines(keys, lines=20000, repeat=5):
+    subs = [('@KEY%d@' % k, 'value %d' % k) for k in range(keys)]
+    # Most lines of a large template don't have a key.
+    contents = ''.join('#define LINE%d "@KEY%d@"\n' % (line, line % keys) if line % 10 == 0
+                       else '// line %d\n' % line for line in range(lines))
+    results = {}
+    for name, engine in (('sequential', sequential), ('single-pass', subst_file.substitute)):
+        start = time.time()
+        for i in range(repeat):
+            results[name] = engine(contents, subs)
+        elapsed = (time.time() - start) / repeat
+        print('%-11s %6d lines %3d keys %8.3fs' % (name, lines, keys, elapsed))
+    return results['sequential'] == results['single-pass']
+
+def main(files=200, keys=30):
+    root = tempfile.mkdtemp(prefix='subst_file_bench')
+    try:
+        os.makedirs(os.path.join(root, 'in'))
+        jobs = make_jobs(root, files, keys)
+        results = {}
+        for name, run in (('per-file', per_file), ('batch', batch)):
+            os.makedirs(os.path.join(root, 'out'))
+            start = time.time()
+            run(root, jobs)
+            elapsed = time.time() - start
+            results[name] = read_outputs(jobs)
+            shutil.rmtree(os.path.join(root, 'out'))
+            print('%-10s %4d files %3d keys %8.3fs' % (name, files, keys, elapsed))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if results['per-file'] != results['batch']:
+        print('FAILED: batch output differs from per-file output')
+        return 1
+    if not compare_engines(keys):
+        print('FAILED: single pass output differs from sequential output')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        print(sys.argv[0] + ': [files [keys]]')
+        sys.exit(1)
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -11,7 +11,9 @@ import sys
 import glob
 import json
 import shlex
+import shutil
 import fnmatch
+import hashlib
 import requests
 import subprocess
 import multiprocessing
@@ -27,22 +29,33 @@ def sibling(*file):
     return os.path.normpath(os.path.join(my_dir, *file))
 
 try:
+    import ninja_log
     import ninja_syntax
+    import ccache_config
     import touch_compiler_timestamps
+    import subst_file
 except ImportError:
     # Sometimes we can't import a sibling file. This makes it possible.
     sys.path.append(my_dir)
+    import ninja_log
     import ninja_syntax
+    import ccache_config
     import touch_compiler_timestamps
+    import subst_file
 
 split_lines_script = os.path.join(my_dir, 'split_lines.py')
 subst_file_script = os.path.join(my_dir, 'subst_file.py')
 test_list_script = os.path.join(my_dir, 'test_list.py')
 touch_compiler_timestamps_script = os.path.join(my_dir, 'touch_compiler_timestamps.py')
+cache_report_script = os.path.join(my_dir, 'cache_report.py')
+build_report_script = os.path.join(my_dir, 'build_report.py')
+ninja_helper_script = os.path.join(my_dir, 'ninja_helper.py')
+edge_launcher_script = os.path.join(my_dir, 'edge_launcher.py')
+install_file_script = os.path.join(my_dir, 'install_file.py')
 
 verify_icecream_script = os.path.join(my_dir, 'darwin', 'verify_icecream.py')
 
-icecc_create_env = os.path.join(my_dir, 'icecream', 'icecc-create-env')
+icecc_create_env = os.path.join(my_dir, 'icecream', 'create_env.py')
 
 def makeNinjaFile(target, source, env):
     assert not source
@@ -54,6 +67,33 @@ def rglob(pattern, root='.') :
             for path, dirs, files in os.walk(root, followlinks=True)
             for f in fnmatch.filter(files, pattern)]
 
+# The ninja version that each feature build.ninja can use was added in, and whether older versions
+# can't run a build.ninja that uses it. Only the features supported by the installed ninja are used,
+# and build.ninja then requires the newest of those versions that older ones can't run.
+NINJA_FEATURES = {
+    # Edges with deps can have multiple outputs. This lets us tell ninja about the .cpp files that
+    # IDL generates and the .dwo files from -gsplit-dwarf.
+    'multi_output_deps': ([1, 10], True),
+    # Ninja starts the edges on the longest chain of recorded durations first.
+    'critical_path_scheduling': ([1, 12], False),
+    # Phony edges take the mtime of their newest input, which --ninja-fine-header-deps needs.
+    'phony_mtimes': ([1, 11], False),
+}
+
+def ninja_features(version):
+    """Returns the set of NINJA_FEATURES that ninja version supports."""
+    return set(name for name, (added, _) in NINJA_FEATURES.items()
+               if version and version >= added)
+
+def ninja_version(ninja):
+    try:
+        raw = subprocess.check_output([ninja, '--version']).decode('utf8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    # Builds from git and some distros add suffixes like 1.11.1.git.kitware.jobserver-1.
+    m = re.match(r'(\d+)\.(\d+)(?:\.(\d+))?', raw)
+    return [int(part) for part in m.groups() if part is not None] if m else []
+
 def where_is(env, exe):
     path = env.WhereIs(exe)
     if not path:
@@ -105,53 +145,297 @@ def get_dependencies(node, skip_sources=False):
     return [get_path(src_file(child)) for child in node.children()]
 
 
+def write_file_atomic(path, contents):
+    with open(path + '.tmp', 'w') as f:
+        f.write(contents)
+    os.replace(path + '.tmp', path)
+
+def sha256_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def parse_sha256_manifest(text, name):
+    # Accepts both the bare hash and the `sha256sum` format of "<hash>  <name>" lines.
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 1 or (len(parts) == 2 and parts[1].lstrip('*') == name):
+            return parts[0].lower()
+    return None
+
+def download_file(url, dest, size):
+    # Stream into a .part file so that interrupted downloads can be resumed with a range request
+    # and so that dest only ever holds a complete file.
+    part_file = dest + '.part'
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    if offset >= size:
+        return part_file
+
+    headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+    response = requests.get(url, headers=headers, stream=True)
+    if response.status_code == 206:
+        print("resuming {} at {}MB".format(url, offset // (1024*1024)))
+        mode = 'ab'
+    elif response.ok:
+        mode = 'wb' # The server ignored the range, so start over.
+    else:
+        print("error fetching latest icecream env: " + str(response))
+        Exit(1)
+
+    with response, open(part_file, mode) as f:
+        for chunk in response.iter_content(chunk_size=1024*1024):
+            f.write(chunk)
+    return part_file
+
 def fetch_icecream_tarball():
-    LINK_URL = 'http://mongodbtoolchain.build.10gen.cc/icecream/ubuntu1604/x86_64/latest'
+    # The mirror may be a local directory (or file:// url) with the same layout as the server: a
+    # `latest` symlink pointing at the tarball, and a `<tarball>.sha256` manifest next to it.
+    mirror = GetOption('icecream_mirror') or 'http://mongodbtoolchain.build.10gen.cc/icecream'
+    if mirror.startswith('file://'):
+        mirror = mirror[len('file://'):]
+    is_local = '://' not in mirror
+    LINK_URL = '/'.join([mirror.rstrip('/'), 'ubuntu1604', 'x86_64', 'latest'])
     NAME_FILE = 'build/icecc_envs/latest'
     os.makedirs('build/icecc_envs', exist_ok = True)
 
-    response = requests.head(LINK_URL, allow_redirects=True)
-    if not response.ok:
-        if os.path.exists(NAME_FILE):
-            with open(NAME_FILE) as f:
-                local_file = f.read()
-                print("Can't fetch {}, assuming {} is up to date".format(LINK_URL, local_file))
-                return local_file
-        else:
-            print("error fetching url for latest icecream env: " + str(response))
+    def use_existing(reason):
+        if not os.path.exists(NAME_FILE):
+            print("error fetching url for latest icecream env: " + reason)
             Exit(1)
-
-    url = response.url
-    size = int(response.headers['Content-length'])
-
-    remote_file = url.split('/')[-1]
+        with open(NAME_FILE) as f:
+            local_file = f.read()
+            print("Can't fetch {} ({}), assuming {} is up to date".format(
+                LINK_URL, reason, local_file))
+            return local_file
+
+    if is_local:
+        if not os.path.exists(LINK_URL):
+            return use_existing('not found')
+        url = os.path.realpath(LINK_URL)
+        size = os.path.getsize(url)
+        manifest_file = url + '.sha256'
+        manifest = None
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                manifest = f.read()
+    else:
+        try:
+            response = requests.head(LINK_URL, allow_redirects=True)
+        except requests.exceptions.RequestException as e:
+            return use_existing(str(e))
+        if not response.ok:
+            return use_existing(str(response))
+        url = response.url
+        size = int(response.headers['Content-length'])
+        try:
+            response = requests.get(url + '.sha256')
+        except requests.exceptions.RequestException as e:
+            return use_existing(str(e))
+        manifest = response.text if response.ok else None
+
+    remote_file = url.replace('\\', '/').split('/')[-1]
     local_file = os.path.join('build', 'icecc_envs', remote_file)
+    expected_sha = manifest and parse_sha256_manifest(manifest, remote_file)
+    if not expected_sha:
+        print("*** WARNING: no sha256 manifest for {}, only checking its size".format(url))
+
+    # The hash of the file we last verified is cached next to it so that up to date checks don't
+    # need to read the whole tarball.
+    verified_file = local_file + '.sha256'
+
+    def is_valid(path):
+        if os.stat(path).st_size != size:
+            return False
+        if not expected_sha:
+            return True
+        if (path == local_file
+                and os.path.exists(verified_file)
+                and os.stat(verified_file).st_mtime >= os.stat(path).st_mtime):
+            with open(verified_file) as f:
+                if f.read() == expected_sha:
+                    return True
+        return sha256_file(path) == expected_sha
+
     if (os.path.exists(NAME_FILE)
             and os.path.exists(local_file)
-            and os.stat(local_file).st_size == size):
+            and is_valid(local_file)):
         with open(NAME_FILE) as f:
-            if f.read() == remote_file:
+            if f.read() == local_file:
                 print("{} up to date".format(local_file))
                 return local_file
 
     print("fetching {} ({}MB)".format(url, size // (1024*1024)))
-    response = requests.get(url)
-    if not response.ok:
-        print("error fetching latest icecream env: " + str(response))
+    if is_local:
+        part_file = local_file + '.part'
+        shutil.copyfile(url, part_file)
+    else:
+        part_file = download_file(url, local_file, size)
+
+    if not is_valid(part_file):
+        # Don't keep a bad file around to be resumed.
+        os.remove(part_file)
+        print("*** ERROR: {} doesn't match its size or sha256 manifest".format(url))
         Exit(1)
-    with open(local_file, "wb") as f:
-        f.write(response.content)
+    os.replace(part_file, local_file)
+    if expected_sha:
+        write_file_atomic(verified_file, expected_sha)
 
-    with open(NAME_FILE, 'w') as f:
-        f.write(local_file)
+    write_file_atomic(NAME_FILE, local_file)
 
     return local_file
 
 
+def real_linker(env):
+    """Returns the linker that the compiler driver runs for LINK and SHLINK."""
+    linker = 'ld'
+    for flag in env.subst('$LINKFLAGS').split():
+        if flag.startswith('-fuse-ld='):
+            linker = flag.split('=', 1)[1]
+    if os.path.isabs(linker):
+        return linker
+    return env.WhereIs(linker if linker.startswith('ld') else 'ld.' + linker)
+
+def try_link(env, linkflags, tmp_dir):
+    """Whether a program with split dwarf debug info links with these extra flags."""
+    source = os.path.join(tmp_dir, 'test.cpp')
+    with open(source, 'w') as f:
+        f.write('#include <string>\nint main() { return std::string("ninja").size(); }\n')
+    cmd = (shlex.split(env.subst('$CXX')) +
+           ['-g', '-gsplit-dwarf', source, '-o', os.path.join(tmp_dir, 'test')] + linkflags)
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(cmd, cwd=tmp_dir, stdout=devnull, stderr=devnull) == 0
+
+def try_thin_archive(env, tmp_dir):
+    obj = os.path.join(tmp_dir, 'test.o')
+    cmd = shlex.split(env.subst('$CXX')) + ['-c', '-x', 'c++', os.devnull, '-o', obj]
+    with open(os.devnull, 'w') as devnull:
+        if subprocess.call(cmd, stdout=devnull, stderr=devnull) != 0:
+            return False
+        cmd = shlex.split(env.subst('$AR')) + ['rcT', os.path.join(tmp_dir, 'test.a'), obj]
+        return subprocess.call(cmd, stdout=devnull, stderr=devnull) == 0
+
+def set_up_fast_link(env):
+    """Turns on split dwarf, a faster linker with a gdb index, and thin archives if supported."""
+    import tempfile
+    tmp_dir = tempfile.mkdtemp(prefix='ninja_fast_link')
+    try:
+        features = ['split dwarf']
+        env.AppendUnique(CCFLAGS=['-gsplit-dwarf'])
+
+        # Respect a linker that was already picked.
+        if any(flag.startswith('-fuse-ld=') for flag in env.subst('$LINKFLAGS').split()):
+            linkers = [('', [])]
+        else:
+            threads = '-Wl,--thread-count=%d' % multiprocessing.cpu_count()
+            # lld is already multithreaded, gold needs to be asked.
+            linkers = [('lld', ['-fuse-ld=lld']),
+                       ('gold', ['-fuse-ld=gold', '-Wl,--threads', threads]),
+                       ('gold', ['-fuse-ld=gold']),
+                       ('', [])]
+        candidates = ([(name, flags + ['-Wl,--gdb-index'], True) for name, flags in linkers] +
+                      [(name, flags, False) for name, flags in linkers if flags])
+        for name, flags, gdb_index in candidates:
+            if try_link(env, flags, tmp_dir):
+                env.Append(LINKFLAGS=flags)
+                if name:
+                    features.append(name)
+                if '-Wl,--threads' in flags:
+                    features.append('threads')
+                if gdb_index:
+                    features.append('gdb index')
+                break
+
+        arflags = env.subst('$ARFLAGS').split()
+        if arflags and 'T' not in arflags[0] and try_thin_archive(env, tmp_dir):
+            arflags[0] += 'T'
+            env['ARFLAGS'] = arflags
+            features.append('thin archives')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    print('Fast link mode: ' + ', '.join(features))
+
+def write_if_changed(path, content):
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return
+    write_file_atomic(path, content)
+
+
 def is_interesting_flatten_target(target):
     return ("/bin/" in target or "\\bin\\" in target) and not "_test" in target and not "_bm" in target
 
 
+# For os.stat's nanosecond mtimes, among others.
+EDGE_LAUNCHER_MIN_PYTHON = (3, 3)
+
+DEFAULT_LINK_RSS_KB = 4 * 1024 * 1024
+
+# Commands that do the same as these scons ActionFactories with the paths as arguments, so they
+# don't need to run scons. Copy is handled separately since it becomes an INSTALL.
+POSIX_ACTION_FACTORY_COMMANDS = {
+    SCons.Defaults.Mkdir: 'mkdir -p',
+    SCons.Defaults.Touch: 'touch',
+}
+
+# Some of our TUs take substantially longer to compile, and usually need a lot more memory. The list
+# of TUs was determined empirically by timing each compile at -j1 (NINJA_STATUS='%e %p ' makes this
+# easier). We should probably revisit this list periodically.
+SLOW_TU_PARTS = [
+    "topology_coordinator_v1_test",
+    "storage_interface_impl_test",
+    "expression_convert_test",
+    "transaction_coordinator_futures_util_test",
+    "options_parser_test",
+    "future_test_future", # multiple slow TUs
+    "query_planner_test",
+    "replication_coordinator_impl_test",
+    "expression_test",
+    "transport_layer_asio", # not as quite slow as others, but orig order put it very late.
+]
+
+COMPILE_RULES = ('CXX', 'SHCXX', 'CC', 'SHCC')
+
+# Compiles recorded above either of these go in the heavy_compile pool.
+HEAVY_COMPILE_RSS_KB = 1536 * 1024
+HEAVY_COMPILE_MS = 60 * 1000
+# What to assume for compiles in each pool without a record of their peak memory.
+DEFAULT_HEAVY_COMPILE_RSS_KB = 3 * 1024 * 1024
+DEFAULT_LIGHT_COMPILE_RSS_KB = 512 * 1024
+
+INCLUDE_RE = re.compile(r'^\s*#\s*include\s*["<]([^">]+)[">]', re.M)
+
+def included_generated_headers(source, generated_by_name):
+    """Returns the generated headers that source includes directly.
+
+    generated_by_name maps the basename of each generated header to their paths.
+    """
+    try:
+        with open(source, errors='replace') as f:
+            includes = INCLUDE_RE.findall(f.read())
+    except IOError:
+        return []
+    return [header for include in includes
+            for header in generated_by_name.get(os.path.basename(include), ())
+            if header.endswith(os.sep + os.path.normpath(include))]
+
+def uses_thin_archives(env):
+    flags = env.subst('$ARFLAGS').split()
+    return '--thin' in flags or bool(flags and not flags[0].startswith('-') and 'T' in flags[0])
+
+def available_memory_kb():
+    """Returns the memory that can be used without swapping, in KiB, or None if unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return None
+
 class NinjaFile(object):
     def __init__(self, name, env):
         self.ninja_file = name
@@ -161,19 +445,53 @@ class NinjaFile(object):
         self.overrides = {}
         self.tool_commands = {}
         self.tool_paths = set()
+        # The binaries that each rule runs, so it can be rerun when any of them is upgraded.
+        self.rule_tool_paths = {}
         self.builds = []
         self.built_targets = set()
         self.generated_headers = set()
+        # Narrower phonies over the generated headers that compiles in a directory include.
+        self.generated_header_groups = {}
         self.rc_files = []
         self.unittest_shortcuts = {}
         self.unittest_skipped_shortcuts = set()
         self.setup_test_execution = not env.get('_NINJA_NO_TEST_EXECUTION', False)
         self.flatten_install = GetOption('flatten_hygienic')
         self.enable_dwarf64 = GetOption('enable_dwarf64')
+        self.builddir = GetOption('ninja_builddir') or '.'
+        self.ninja_features = ninja_features(env.get('_NINJA_VERSION', []))
+        self.cache_report = env.get('_NINJA_CCACHE') and GetOption('ninja_cache_report')
+        # Written for the reporting tools that need to know which rule built each output. It is
+        # always written, since they are often run against a build made without the options
+        # that need them.
+        self.edges_file = os.path.join(self.builddir, '.ninja_edges.json')
+        self.compile_db = None
+        # The compile commands before ccache and icecream wrap them, for the compile db.
+        self.compile_db_commands = {}
+        self.batch_subst = GetOption('ninja_batch_subst')
+        self.helper_socket = None
+        if GetOption('ninja_helper'):
+            self.helper_socket = os.path.join(self.builddir, '.ninja_helper.sock')
+        self.subst_jobs = []
+        # What each compile, link and test used, recorded by the edge launcher.
+        self.resource_log = os.path.join(self.builddir, '.ninja_resources')
+        self.track_resources = GetOption('ninja_track_resources')
+        self.cutoff = GetOption('ninja_cutoff')
+        self.action_cache = GetOption('ninja_action_cache')
+        if self.action_cache:
+            self.action_cache = os.path.abspath(self.action_cache)
+        # The depth of each pool that compiles are assigned to, if any.
+        self.compile_pools = {}
 
         self.init_idl_dependencies()
         self.find_build_nodes()
         self.find_aliases()
+        if GetOption('ninja_fine_header_deps'):
+            self.narrow_generated_header_deps()
+        if self.subst_jobs:
+            self.add_subst_batch()
+        if GetOption('ninja_batch_scons'):
+            self.add_scons_batch()
         self.add_run_test_builds()
         self.set_up_complier_upgrade_check()
 
@@ -182,6 +500,8 @@ class NinjaFile(object):
         #     self.add_error_code_check()
         if env.get('_NINJA_CCACHE'):
             self.set_up_ccache()
+            if self.cache_report:
+                self.add_cache_report()
         if env.get('_NINJA_ICECC'):
             if env.TargetOSIs('darwin'):
                 self.add_icecream_check()
@@ -190,7 +510,16 @@ class NinjaFile(object):
         if GetOption('pch'):
             self.enable_pch()
 
-        self.hide_slow_compile_latency()
+        if not ('critical_path_scheduling' in self.ninja_features
+                and os.path.exists(os.path.join(self.builddir, '.ninja_log'))):
+            # Otherwise ninja orders by what each edge actually took last time.
+            self.hide_slow_compile_latency()
+
+        # Compiles run elsewhere with icecream, so local memory doesn't limit them.
+        if self.track_resources:
+            self.add_build_report()
+            if not env.get('_NINJA_ICECC'):
+                self.assign_compile_pools()
 
         assert 'COPY' not in self.vars
         if self.globalEnv.TargetOSIs('windows'):
@@ -333,26 +662,40 @@ class NinjaFile(object):
         # the configure step depend on the now_file, so they get rerun whenever it is updated. This
         # is all to work around the fact that package managers back-date the mtimes when installing
         # to the time is was build rather than the time it was installed, so just depending on the
-        # compiler itself doesn't actually work.
-        cxx = self.globalEnv.WhereIs('$CXX')
-        cxx_escaped = cxx.replace('/', '_').replace('\\', '_').replace(':', '_')
-        now_file = os.path.join('build', 'compiler_timestamps', cxx_escaped + '.last_update')
-        then_file = os.path.join('build', 'compiler_timestamps', cxx_escaped + '.mtime')
-        self.compiler_timestamp_file = now_file
+        # compiler itself doesn't actually work. The then_file also holds a fingerprint of the
+        # compiler so that reinstalling the same compiler doesn't update the now_file.
+        #
+        # There is a pair of files for each tool (compilers, linkers and ar), and each rule depends
+        # on the now_files for the tools it runs. Upgrading the linker only relinks.
+        self.tool_timestamp_files = {}
+        def timestamp_file(tool_path):
+            if tool_path not in self.tool_timestamp_files:
+                escaped = tool_path.replace('/', '_').replace('\\', '_').replace(':', '_')
+                now_file = os.path.join('build', 'compiler_timestamps', escaped + '.last_update')
+                then_file = os.path.join('build', 'compiler_timestamps', escaped + '.mtime')
+
+                # Run it now if needed so that we don't need to reconfigure twice since the
+                # configure job depends on the compiler timestamps.
+                touch_compiler_timestamps.run_if_needed(tool_path, then_file, now_file)
 
-        # Run it now if needed so that we don't need to reconfigure twice since the configure job
-        # depends on the timestamp.
-        touch_compiler_timestamps.run_if_needed(cxx, then_file, now_file)
-
-
-        self.builds.append(dict(
-            rule='COMPILER_TIMESTAMPS',
-            inputs=cxx,
-            outputs=[then_file, now_file]))
+                self.builds.append(dict(
+                    rule='COMPILER_TIMESTAMPS',
+                    inputs=tool_path,
+                    outputs=[then_file, now_file]))
+                self.tool_timestamp_files[tool_path] = now_file
+            return self.tool_timestamp_files[tool_path]
+
+        self.compiler_timestamp_file = timestamp_file(self.globalEnv.WhereIs('$CXX'))
+        self.compiler_timestamp_files = [self.compiler_timestamp_file]
+        cc = self.globalEnv.WhereIs('$CC')
+        if cc:
+            self.compiler_timestamp_files.append(timestamp_file(cc))
 
+        rule_timestamp_files = dict((rule, [timestamp_file(path) for path in paths])
+                                    for rule, paths in sorted(self.rule_tool_paths.items()))
         for build in self.builds:
-            if build['rule'] in ('CC', 'CXX', 'SHCC', 'SHCXX'):
-                build.setdefault('implicit', []).append(self.compiler_timestamp_file)
+            if build['rule'] in rule_timestamp_files:
+                build.setdefault('implicit', []).extend(rule_timestamp_files[build['rule']])
 
     def add_error_code_check(self):
         timestamp_file = os.path.join('build', 'compiler_timestamps', 'error_code_check.timestamp')
@@ -398,12 +741,61 @@ class NinjaFile(object):
 
 
     def set_up_ccache(self):
+        # Settings like the remote storage and base dir are passed in the environment so that they
+        # apply to these builds without touching the user's ccache.conf.
+        ccache_env = list(self.globalEnv.get('_NINJA_CCACHE_ENV', []))
+        if self.cache_report:
+            # ccache logs the result of each compile here for cache_report.py.
+            ccache_env.append('CCACHE_STATSLOG=' + os.path.abspath(self.ccache_stats_log()))
+        ccache = ' '.join([ninja_syntax.escape(assignment) for assignment in ccache_env]
+                          + [self.globalEnv['_NINJA_CCACHE']])
         for rule in ('CC', 'CXX', 'SHCC', 'SHCXX'):
             if rule in self.tool_commands:
+                self.compile_db_commands.setdefault(rule, self.tool_commands[rule])
                 self.tool_commands[rule] = '{} {}'.format(
-                        self.globalEnv['_NINJA_CCACHE'],
+                        ccache,
                         self.tool_commands[rule])
 
+    def ccache_stats_log(self):
+        return os.path.join(self.builddir, '.ccache_stats.log')
+
+    def add_cache_report(self):
+        # Run this after a build to see how it used ccache. It reports on everything built since
+        # the last time it ran.
+        self.builds.append(dict(
+            rule='EXEC',
+            inputs='_ALWAYS_BUILD',
+            outputs='cache_report',
+            implicit=[cache_report_script],
+            variables=dict(
+                command='$PYTHON {} {} {} {} {} {}'.format(
+                    cache_report_script,
+                    self.globalEnv['_NINJA_CCACHE'],
+                    os.path.join(self.builddir, '.ninja_log'),
+                    self.edges_file,
+                    self.ccache_stats_log(),
+                    os.path.join(self.builddir, '.ccache_stats.json')),
+                description='Reporting ccache usage',
+                pool='console',
+                )))
+
+    def add_build_report(self):
+        # Run this after a build to see what it spent its time and resources on.
+        self.builds.append(dict(
+            rule='EXEC',
+            inputs='_ALWAYS_BUILD',
+            outputs='build_report',
+            implicit=[build_report_script],
+            variables=dict(
+                command='$PYTHON {} {} {} {}'.format(
+                    build_report_script,
+                    os.path.join(self.builddir, '.ninja_log'),
+                    self.edges_file,
+                    self.resource_log),
+                description='Reporting on the last build',
+                pool='console',
+                )))
+
     def set_up_icecc(self):
         cc = self.globalEnv.WhereIs('$CC')
         cxx = self.globalEnv.WhereIs('$CXX')
@@ -434,9 +826,9 @@ class NinjaFile(object):
                     rule='MAKE_ICECC_ENV',
                     inputs=icecc_create_env,
                     outputs=version_file,
-                    implicit=[cc, self.compiler_timestamp_file],
+                    implicit=[cc] + self.compiler_timestamp_files,
                     variables=dict(
-                        cmd='{icecc_create_env} --clang {clang} {compiler_wrapper} {out}'.format(
+                        cmd='$PYTHON {icecc_create_env} --clang {clang} {compiler_wrapper} {out}'.format(
                             icecc_create_env=icecc_create_env,
                             clang=os.path.realpath(cc),
                             compiler_wrapper='/bin/true', # we require a new enough iceccd.
@@ -459,9 +851,9 @@ class NinjaFile(object):
                 rule='MAKE_ICECC_ENV',
                 inputs=icecc_create_env,
                 outputs=version_file,
-                implicit=[cc, cxx, self.compiler_timestamp_file],
+                implicit=[cc, cxx] + self.compiler_timestamp_files,
                 variables=dict(
-                    cmd='{icecc_create_env} --gcc {gcc} {gxx} {out}'.format(
+                    cmd='$PYTHON {icecc_create_env} --gcc {gcc} {gxx} {out}'.format(
                         icecc_create_env=icecc_create_env,
                         gcc=os.path.realpath(cc),
                         gxx=os.path.realpath(cxx),
@@ -471,6 +863,7 @@ class NinjaFile(object):
 
         for rule in ('CC', 'CXX', 'SHCC', 'SHCXX'):
             if rule in self.tool_commands:
+                self.compile_db_commands.setdefault(rule, self.tool_commands[rule])
                 self.tool_commands[rule] = (
                         ' '.join(env_flags + [self.tool_commands[rule]] + compile_flags))
 
@@ -525,31 +918,358 @@ class NinjaFile(object):
             self.aliases['integration_tests']= [t for t in self.built_targets
                                                   if t.startswith(integration_tests_dir)]
 
+    def narrow_generated_header_deps(self):
+        # Every compile waits for all generated headers by default, so on a clean build no
+        # compile can start until all of the IDL and other codegen is done. Instead, gate the
+        # compiles in each directory on just the generated headers that they can include: the
+        # ones they included last time according to .ninja_deps, the ones their sources include
+        # directly and the ones generated in that directory, plus whatever generated headers those
+        # include or import, transitively.
+        #
+        # That set is only complete if every compile in the directory and every header in it is
+        # up to date with the files it was built from. Directories where that doesn't hold wait for
+        # all generated headers, which is every directory on a clean build. For the others, a
+        # dyndep edge depends on the files that showed it. If any of them changes before
+        # build.ninja is generated again, it makes the compiles in the directory depend on all
+        # generated headers.
+        if 'phony_mtimes' not in self.ninja_features:
+            print('*** WARNING: --ninja-fine-header-deps needs ninja >= 1.11')
+            return
+        deps_log = os.path.join(self.builddir, '.ninja_deps')
+        if not os.path.exists(deps_log):
+            return
+        try:
+            recorded = ninja_log.read_deps(deps_log)
+        except ValueError as e:
+            print('*** WARNING: not narrowing generated header deps: %s' % e)
+            return
+        recorded = dict((os.path.normpath(output), [os.path.normpath(d) for d in deps])
+                        for output, deps in recorded.items())
+
+        generated = set(os.path.normpath(h) for h in self.generated_headers)
+        by_dir = {}
+        by_name = {}
+        for header in generated:
+            by_dir.setdefault(os.path.dirname(header), set()).add(header)
+            by_name.setdefault(os.path.basename(header), []).append(header)
+
+        producers = {}
+        for build in self.builds + [build for build, _ in self.subst_jobs]:
+            for output in (ninja_syntax.as_list(build['outputs']) +
+                           ninja_syntax.as_list(build.get('implicit_outputs'))):
+                producers[os.path.normpath(output)] = build
+        # The generated headers built from each file, such as the header of each IDL file.
+        generated_from = {}
+        for header in generated:
+            for source in ninja_syntax.as_list(producers.get(header, {}).get('inputs')):
+                generated_from.setdefault(os.path.normpath(source), []).append(header)
+        stale = self.stale_generated_headers(producers, generated)
+
+        mtimes = {}
+        def mtime(path):
+            if path not in mtimes:
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtimes[path] = None
+            return mtimes[path]
+
+        proofs = {}
+        def built_from(output, inputs):
+            """Returns the files that aren't built that output is built from, if it and every
+            output it is built from are up to date with them, otherwise None."""
+            if output in proofs:
+                return proofs[output]
+            proofs[output] = None # Guards against cycles.
+            built = mtime(output)
+            if built is None or output in stale:
+                return None
+            files = set()
+            for dep in inputs:
+                dep = os.path.normpath(dep)
+                if mtime(dep) is None or mtime(dep) > built:
+                    return None
+                if dep in producers:
+                    build = producers[dep]
+                    dep_files = built_from(dep, ninja_syntax.as_list(build.get('inputs')) +
+                                           ninja_syntax.as_list(build.get('implicit')) +
+                                           recorded.get(dep, []))
+                    if dep_files is None:
+                        return None
+                    files |= dep_files
+                else:
+                    files.add(dep)
+            proofs[output] = files
+            return files
+
+        includes = {}
+        def close(headers):
+            """Adds the generated headers that headers include or import, transitively. Returns
+            the files they are built from, or None if they aren't all up to date."""
+            files = set()
+            pending = list(headers)
+            while pending:
+                header = pending.pop()
+                if header not in producers:
+                    return None
+                build = producers[header]
+                inputs = ninja_syntax.as_list(build.get('inputs'))
+                header_files = built_from(header, inputs +
+                                          ninja_syntax.as_list(build.get('implicit')) +
+                                          recorded.get(header, []))
+                if header_files is None:
+                    return None
+                files |= header_files
+                if header not in includes:
+                    includes[header] = included_generated_headers(header, by_name)
+                more = list(includes[header])
+                for dep in inputs + recorded.get(header, []):
+                    more += generated_from.get(os.path.normpath(dep), [])
+                for dep in more:
+                    if dep not in headers:
+                        headers.add(dep)
+                        pending.append(dep)
+            return files
+
+        compiles = {}
+        for build in self.builds:
+            if build['rule'] in COMPILE_RULES and build.get('order_only') == ['_generated_headers']:
+                output = os.path.normpath(ninja_syntax.as_list(build['outputs'])[0])
+                compiles.setdefault(os.path.dirname(output), []).append((output, build))
+
+        checked_files = set()
+        for dir, builds in sorted(compiles.items()):
+            headers = set(by_dir.get(dir, ()))
+            files = set()
+            for output, build in builds:
+                sources = ninja_syntax.as_list(build['inputs'])
+                if output not in recorded:
+                    break
+                output_files = built_from(output, sources + recorded[output])
+                if output_files is None:
+                    break
+                files |= output_files
+                headers.update(d for d in recorded[output] if d in generated)
+                for source in sources:
+                    headers.update(included_generated_headers(source, by_name))
+            else:
+                header_files = close(headers)
+                if header_files is None:
+                    continue
+                files |= header_files
+                checked_files |= files
+
+                group = '_generated_headers_' + dir
+                self.generated_header_groups[group] = headers
+                dyndep = self.add_header_dyndep(dir, builds, files, mtime)
+                for output, build in builds:
+                    build['order_only'] = [group, dyndep]
+                    build['variables'] = dict(build.get('variables') or {}, dyndep=dyndep)
+
+        if self.generated_header_groups:
+            # Falling back makes compiles depend on this, rather than _generated_headers, so they
+            # wait for every generated header without being rebuilt whenever one changes.
+            barrier = os.path.join(self.builddir, '.generated_headers.barrier')
+            if not os.path.exists(barrier):
+                # Old enough that falling back doesn't make every compile look out of date. Ninja
+                # takes an mtime of 0 to mean missing.
+                open(barrier, 'w').close()
+                os.utime(barrier, (1, 1))
+            self.builds.append(dict(
+                rule='HEADER_DYNDEP',
+                outputs=[barrier],
+                order_only=['_generated_headers'],
+                variables={
+                    'rspfile_content': ninja_syntax.escape(json.dumps(dict(do_chmod=False,
+                                                                           contents=''))),
+                    'script': subst_file_script,
+                    },
+                ))
+
+        # A file that the dyndep edges depend on being deleted should make them fall back rather
+        # than fail the build, like a header in .ninja_deps being deleted does.
+        for path in sorted(checked_files):
+            self.builds.append(dict(rule='phony', outputs=[path]))
+        for header_dir in sorted(set(os.path.dirname(path) for path in checked_files)):
+            self.builds.append(dict(
+                rule='phony',
+                outputs=['_checked_headers_' + header_dir],
+                inputs=sorted(path for path in checked_files
+                              if os.path.dirname(path) == header_dir)))
+
+    def stale_generated_headers(self, producers, generated):
+        """Returns the generated headers whose builds changed since they were last built.
+
+        Ninja builds them again with the new commands, which may change what they include.
+        """
+        index_file = os.path.join(self.builddir, '.ninja_generated_headers.json')
+        try:
+            with open(index_file) as f:
+                old = json.load(f)
+        except (IOError, ValueError):
+            old = {}
+        index = {}
+        for header in sorted(generated):
+            if header not in producers:
+                continue
+            digest = hashlib.sha1(json.dumps(producers[header], sort_keys=True,
+                                             default=str).encode('utf8')).hexdigest()
+            try:
+                built = os.stat(header).st_mtime_ns
+            except OSError:
+                built = None
+            old_digest, stale_mtime = old.get(header, (None, None))
+            if old_digest != digest:
+                # Until it is built again, it may have been built by an older command. Headers are
+                # also counted as stale the first time they are seen.
+                stale_mtime = built
+            elif built != stale_mtime:
+                stale_mtime = None
+            index[header] = [digest, stale_mtime]
+
+        with open(index_file + '.tmp', 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(index_file + '.tmp', index_file)
+        return set(h for h, (_, stale_mtime) in index.items() if stale_mtime is not None)
+
+    def add_header_dyndep(self, dir, builds, files, mtime):
+        """Adds the dyndep edge for the compiles in dir, which are gated on the generated headers
+        that files showed they can include, and returns its output.
+
+        It is written now, saying that the compiles need nothing more. If any of the files change
+        before build.ninja is generated again, ninja rebuilds it to make them wait for all
+        generated headers until then.
+        """
+        def dyndep(implicit):
+            return 'ninja_dyndep_version = 1\n' + ''.join(
+                'build %s: dyndep%s\n' % (ninja_syntax.escape_path(output), implicit)
+                for output, _ in builds)
+
+        implicit = sorted(set('_checked_headers_' + os.path.dirname(path) for path in files))
+        # A new name whenever the compiles are rebuilt, so ninja has no record of an older one
+        # being older than the files.
+        key = hashlib.sha1(json.dumps([dyndep(''), implicit] +
+                                      [mtime(output) for output, _ in builds]).encode('utf8'))
+        name = '.generated_headers.%s.dd' % key.hexdigest()[:16]
+        for old in glob.glob(os.path.join(dir, '.generated_headers.*.dd')):
+            if os.path.basename(old) != name:
+                os.remove(old)
+        path = os.path.join(dir, name)
+        with open(path, 'w') as f:
+            f.write(dyndep(''))
+
+        barrier = os.path.join(self.builddir, '.generated_headers.barrier')
+        # Forced, since the fallback is already written if it fell back in an earlier build.
+        args = dict(do_chmod=False, force=True,
+                    contents=dyndep(' | ' + ninja_syntax.escape_path(barrier)))
+        self.builds.append(dict(
+            rule='HEADER_DYNDEP',
+            outputs=[path],
+            implicit=implicit,
+            variables={
+                'rspfile_content': ninja_syntax.escape(json.dumps(args)),
+                'script': subst_file_script,
+                },
+            ))
+        return path
+
+    def independent_builds(self, candidates):
+        """Returns the candidates that don't depend, even transitively, on another candidate.
+
+        These can be merged into a single edge without creating a cycle.
+        """
+        producers = {}
+        for build in self.builds + candidates:
+            for output in strmap(build.get('outputs', [])) + strmap(build.get('implicit_outputs', [])):
+                producers[output] = build
+        aliases = dict(self.aliases, _generated_headers=self.generated_headers,
+                       **self.generated_header_groups)
+        candidate_ids = set(id(build) for build in candidates)
+
+        def deps(name):
+            if name in producers:
+                build = producers[name]
+                return [name for key in ('inputs', 'implicit', 'order_only')
+                        for name in strmap(build.get(key, []))]
+            return strmap(aliases.get(name, []))
+
+        # Whether each path reaches a candidate's output. Iterative since the graph is deep.
+        reaches = {}
+        def reaches_candidate(root):
+            if root in reaches:
+                return reaches[root]
+            stack = [(root, iter(deps(root)))]
+            while stack:
+                name, it = stack[-1]
+                for dep in it:
+                    if dep in reaches:
+                        if reaches[dep]:
+                            reaches[name] = True
+                        continue
+                    if id(producers.get(dep)) in candidate_ids:
+                        reaches[name] = reaches[dep] = True
+                        continue
+                    reaches[dep] = False # Guards against cycles while in progress.
+                    stack.append((dep, iter(deps(dep))))
+                    break
+                else:
+                    stack.pop()
+                    reaches.setdefault(name, False)
+                    if stack and reaches[name]:
+                        reaches[stack[-1][0]] = True
+            return reaches[root]
+
+        independent = []
+        for build in candidates:
+            upstream = strmap(build.get('inputs', [])) + strmap(build.get('implicit', []))
+            if not any(id(producers.get(dep)) in candidate_ids or reaches_candidate(dep)
+                       for dep in upstream):
+                independent.append(build)
+        return independent
+
+    def add_subst_batch(self):
+        # Starting python for each Substfile dominates the time to generate them on a clean build,
+        # so they all share one edge. Ones that depend on another Substfile keep their own edge.
+        args_by_build = dict((id(build), args) for build, args in self.subst_jobs)
+        batched = self.independent_builds([build for build, args in self.subst_jobs])
+        batched_ids = set(id(build) for build in batched)
+        self.builds += [build for build, args in self.subst_jobs if id(build) not in batched_ids]
+        if len(batched) < 2:
+            self.builds += batched
+            return
+
+        jobs = []
+        implicit = set()
+        for build in batched:
+            job = dict(args_by_build[id(build)])
+            if build['inputs']:
+                job['in'] = build['inputs'][0]
+            job['out'] = build['outputs'][0]
+            jobs.append(job)
+            implicit.update(build['implicit'])
+        self.builds.append(dict(
+            rule='SCRIPT_BATCH_RSP',
+            outputs=[build['outputs'][0] for build in batched],
+            inputs=[input for build in batched for input in build['inputs']],
+            implicit=sorted(implicit),
+            variables={
+                'rsp': os.path.join(self.builddir, '.subst_batch.rsp'),
+                'rspfile_content': ninja_syntax.escape(json.dumps(jobs)),
+                'script': subst_file_script,
+                'count': str(len(jobs)),
+                }
+            ))
+
     def hide_slow_compile_latency(self):
         # Some of our TUs take substantially longer to compile. Try to start them first to mask
-        # their high latency by compiling everything else while they are going. The list of TUs was
-        # determined empirically by timing each compile at -j1 (NINJA_STATUS='%e %p ' makes this
-        # easier). We should probably revisit this list periodically.
-
-        slow_tu_parts= [
-            "topology_coordinator_v1_test",
-            "storage_interface_impl_test",
-            "expression_convert_test",
-            "transaction_coordinator_futures_util_test",
-            "options_parser_test",
-            "future_test_future", # multiple slow TUs
-            "query_planner_test",
-            "replication_coordinator_impl_test",
-            "expression_test",
-            "transport_layer_asio", # not as quite slow as others, but orig order put it very late.
-        ]
+        # their high latency by compiling everything else while they are going.
 
         # This is a total hack. Ninja's "scheduler" that decides which task to run next relies on
         # the order of a std::set<Edge*>. By ordering tasks higher, they seem to get lower pointer
         # values, and therefore run earlier. Hopefully we can replace this with a proper priority
         # system if ninja ever implements one.
         def priority(build):
-            if build['rule'].endswith('CXX') and any(s in build['outputs'] for s in slow_tu_parts):
+            if build['rule'].endswith('CXX') and any(s in build['outputs'] for s in SLOW_TU_PARTS):
                 # Slowest tasks go first.
                 return 0
             if build['rule'] == 'CXX':
@@ -622,6 +1342,112 @@ class NinjaFile(object):
             if build['rule'] == 'SCONS':
                 build.setdefault('implicit', []).append(self.ninja_file)
 
+    def add_scons_batch(self):
+        # Each SCONS edge starts scons and reads its config, one at a time in the console pool.
+        # Running everything that doesn't depend on another SCONS edge in one scons invocation pays
+        # for that once. Ones that always build would make all of the others always build too.
+        candidates = [build for build in self.builds
+                      if build['rule'] == 'SCONS' and '_ALWAYS_BUILD' not in build['implicit']]
+        batched = self.independent_builds(candidates)
+        if len(batched) < 2:
+            return
+
+        batched_ids = set(id(build) for build in batched)
+        self.builds = [build for build in self.builds if id(build) not in batched_ids]
+        self.builds.append(dict(
+            rule='SCONS',
+            outputs=[output for build in batched for output in strmap(build['outputs'])],
+            inputs=sorted(set(input for build in batched for input in strmap(build['inputs']))),
+            implicit=sorted(set(dep for build in batched for dep in build['implicit'])),
+            variables={
+                'description': 'SCONSGEN %d targets' % len(batched),
+                },
+            ))
+
+    def translate_function_action(self, action, myEnv, targets, sources, implicit_deps,
+                                  do_chmod):
+        """Adds a build that does what a scons FunctionAction does without running scons.
+
+        Returns whether it knew how to.
+        """
+        if action == SCons.Tool.textfile._text_builder.action:
+            # Textfile writes its sources, which we know now if they are all Values, joined by
+            # LINESEPARATOR, after substituting SUBST_DICT in each.
+            if len(targets) != 1 or not all(isinstance(source, SCons.Node.Python.Value)
+                                            for source in sources):
+                return False
+            linesep = myEnv.get('LINESEPARATOR')
+            if linesep is None:
+                linesep = '\n'
+            elif isinstance(linesep, SCons.Node.Python.Value):
+                linesep = linesep.get_text_contents()
+            subs = myEnv.get('SUBST_DICT') or []
+            if isinstance(subs, dict):
+                subs = subs.items()
+            subs = [(k, v.get_text_contents() if isinstance(v, SCons.Node.Python.Value) else v)
+                    for k, v in subs]
+            contents = linesep.join(subst_file.substitute(source.get_text_contents(), subs)
+                                    for source in sources)
+
+            implicit_deps.append(subst_file_script)
+            args = dict(do_chmod=do_chmod, contents=contents)
+            build = dict(
+                rule='SCRIPT_RSP',
+                outputs=strmap(targets),
+                inputs=[],
+                implicit=implicit_deps,
+                variables={
+                    'rspfile_content': ninja_syntax.escape(json.dumps(args)),
+                    'script': subst_file_script,
+                    }
+                )
+            if self.batch_subst:
+                self.subst_jobs.append((build, args))
+            else:
+                self.builds.append(build)
+            return True
+
+        # Actions made by factories like Copy('$TARGET', '$SOURCE') call an ActionCaller.
+        caller = getattr(action, 'execfunction', None)
+        if not isinstance(caller, SCons.Action.ActionCaller):
+            return False
+        args = [strmap(arg) if SCons.Util.is_List(arg) else [str(arg)]
+                for arg in caller.subst_args(targets, sources, myEnv)]
+        if caller.kw:
+            return False
+
+        if caller.parent is SCons.Defaults.Copy:
+            # Only file copies, since cp can't copy directories. Copy makes a symlink to what a
+            # symlink points to, like cp -P, which copy on windows can't do.
+            if (len(targets) != 1 or len(sources) != 1
+                    or not isinstance(sources[0], SCons.Node.FS.File)
+                    or args != [strmap(targets), strmap(sources)]
+                    or (self.globalEnv.TargetOSIs('windows')
+                        and os.path.islink(sources[0].abspath))):
+                return False
+            self.builds.append(dict(
+                rule='COPY_FILE',
+                outputs=strmap(targets),
+                inputs=strmap(sources),
+                implicit=implicit_deps,
+                ))
+            return True
+
+        command = POSIX_ACTION_FACTORY_COMMANDS.get(caller.parent)
+        if not command or do_chmod or self.globalEnv.TargetOSIs('windows'):
+            return False
+        paths = [path for arg in args for path in arg]
+        self.builds.append(dict(
+            rule='EXEC',
+            outputs=strmap(targets),
+            inputs=strmap([s for s in sources if not isinstance(s, SCons.Node.Python.Value)]),
+            implicit=implicit_deps,
+            variables={
+                'command': ' '.join([command] + [shlex.quote(p) for p in paths]),
+                },
+            ))
+        return True
+
     def make_command(self, cmd):
         cmd = cmd.replace("$?", "$$?")
         lines = cmd.split('\n')
@@ -727,7 +1553,7 @@ class NinjaFile(object):
         if action == SCons.Tool.textfile._subst_builder.action:
             implicit_deps.append(subst_file_script)
             args = dict(do_chmod=do_chmod, subs=myEnv['SUBST_DICT'])
-            self.builds.append(dict(
+            build = dict(
                 rule='SCRIPT_RSP',
                 outputs=strmap(targets),
                 inputs=strmap(sources),
@@ -736,7 +1562,11 @@ class NinjaFile(object):
                     'rspfile_content': ninja_syntax.escape(json.dumps(args)),
                     'script': subst_file_script,
                     }
-                ))
+                )
+            if self.batch_subst and len(targets) == 1 and len(sources) == 1:
+                self.subst_jobs.append((build, args))
+            else:
+                self.builds.append(build)
             return
 
         if len(targets) == 1 and any(str(targets[0]).endswith(suffix)
@@ -766,11 +1596,13 @@ class NinjaFile(object):
                 ))
             return
 
-        if str(targets[0]) == 'compile_commands.json' and self.globalEnv['NINJA']:
+        if str(targets[0]) == 'compile_commands.json':
             assert len(targets) == 1
-            # Use ninja to generate the compile db rather than scons.
+            # We write the compile db ourselves whenever we regenerate the .ninja file since we
+            # already know all of the commands. This just makes the target available to ninja.
+            self.compile_db = str(targets[0])
             self.builds.append(dict(
-                rule='COMPILE_DB',
+                rule='phony',
                 outputs=strmap(targets),
                 inputs=self.ninja_file,
                 order_only=['generated-sources'], # These should be updated along with the compdb.
@@ -852,6 +1684,11 @@ class NinjaFile(object):
                 ))
             return
 
+        if (isinstance(action, SCons.Action.FunctionAction)
+                and self.translate_function_action(action, myEnv, targets, sources,
+                                                   implicit_deps, do_chmod)):
+            return
+
         # TODO find a better way to find things that are functions
         # August 17, 2021 - master now generates unit test executions with:
         # $( $ICERUN $) ${SOURCES[0]} -fileNameFilter $TEST_SOURCE_FILE_NAME $UNITTEST_FLAGS
@@ -875,16 +1712,7 @@ class NinjaFile(object):
             # Important:
             # Originally we ran the IDL scanner during build.ninja file generation but this is
             # single-thread and slow as the number of IDL files has grown to greater then 100.
-            # Now, we let IDL tell Ninja its dependencies. Unfortunately, IDL does not have a good
-            # way to this with its implicit dependency caching and multiple outputs due to a
-            # limitation in ninja.
-            # See https://github.com/ninja-build/ninja/pull/1534
-            #
-            # Instead we split IDL file generation into "two" phases:
-            # 1. Generate the header and the cpp file as normal but only tell Ninja about the header
-            # 2. "Generate" the cpp file by telling Ninja it depends on the header file via a
-            #    phony rule
-            #
+            # Now, we let IDL tell Ninja its dependencies.
             idl_cpp_file = strmap(targets)[0]
             idl_header_file = strmap(targets)[1]
 
@@ -894,6 +1722,34 @@ class NinjaFile(object):
                 + " --write-dependencies-inline")
 
             implicit_deps.extend(self.idl_deps)
+            idl_variables = {
+                'command' : idl_command,
+                'deps' : 'msvc',
+                'msvc_deps_prefix' : 'import file:',
+                }
+
+            if 'multi_output_deps' in self.ninja_features:
+                # Both files are outputs of the edge, so ninja knows to regenerate the cpp file if
+                # it goes missing. The dependencies are inputs that IDL reports when it runs, which
+                # is what deps handles, and the outputs are known up front, so dyndep isn't needed.
+                self.builds.append(dict(
+                    rule='EXEC',
+                    outputs=[idl_header_file],
+                    implicit_outputs=[idl_cpp_file],
+                    inputs=strmap(sources),
+                    implicit=implicit_deps,
+                    variables=idl_variables,
+                    ))
+                return
+
+            # Older versions of ninja don't support multiple outputs with deps.
+            # See https://github.com/ninja-build/ninja/pull/1534
+            #
+            # Instead we split IDL file generation into "two" phases:
+            # 1. Generate the header and the cpp file as normal but only tell Ninja about the header
+            # 2. "Generate" the cpp file by telling Ninja it depends on the header file via a
+            #    phony rule
+            #
 
             # Lie to Ninja by saying it only generates a header
             self.builds.append(dict(
@@ -901,11 +1757,7 @@ class NinjaFile(object):
                 outputs=[idl_header_file],
                 inputs=strmap(sources),
                 implicit=implicit_deps,
-                variables={
-                    'command' : idl_command,
-                    'deps' : 'msvc',
-                    'msvc_deps_prefix' : 'import file:',
-                    }
+                variables=idl_variables,
                 ))
 
             # Tell Ninja the cpp file is "generated" from the header file
@@ -976,7 +1828,8 @@ class NinjaFile(object):
 
             return
 
-        self.tool_paths.add(myEnv.WhereIs(tool))
+        tool_path = myEnv.WhereIs(tool)
+        self.tool_paths.add(tool_path)
 
         tool = tool.strip('${}')
         # This is only designed for tools that use $TARGET and $SOURCES not $TARGETS or $SOURCE.
@@ -992,6 +1845,12 @@ class NinjaFile(object):
         if tool == "CC" and "ASPPFLAGS" in cmd:
             tool = "ACC"
 
+        if tool not in self.rule_tool_paths:
+            paths = [tool_path]
+            if tool in ('LINK', 'SHLINK') and myEnv.ToolchainIs('gcc', 'clang'):
+                paths.append(real_linker(myEnv))
+            self.rule_tool_paths[tool] = [path for path in paths if path]
+
         assert 'TARGET' not in cmd
         assert 'SOURCE' not in cmd
         if tool in self.tool_commands:
@@ -1065,14 +1924,17 @@ class NinjaFile(object):
                 myVars[name] = '$%s_%s'%(name, num)
 
         # Since the scons command line uses '$TARGET' it only expects the first target to be passed.
-        # Everything else must be an implicit output. Additionally, removing .dwo files from targets
-        # to work around ninja limitation that build rules using the 'depslog' can't have multiple
-        # outputs. ccache will still handle them correctly, the only real downside is that the
-        # 'clean' tool won't remove them. An alternative solution would be removing the 'deps=gcc'
-        # setting from the rules definition, but that has significant overhead (~1s no-op builds) so
-        # I don't think the tradeoff is worth it.
+        # Everything else must be an implicit output. Additionally, before ninja 1.10, removing .dwo
+        # files from targets to work around ninja limitation that build rules using the 'depslog'
+        # can't have multiple outputs. ccache will still handle them correctly, the only real
+        # downside is that the 'clean' tool won't remove them and ninja won't notice if they are
+        # deleted. An alternative solution would be removing the 'deps=gcc' setting from the rules
+        # definition, but that has significant overhead (~1s no-op builds) so I don't think the
+        # tradeoff is worth it.
         # For more details see: https://github.com/ninja-build/ninja/issues/1184
-        targets = [t for t in strmap(targets) if not t.endswith('.dwo')]
+        targets = strmap(targets)
+        if 'multi_output_deps' not in self.ninja_features:
+            targets = [t for t in targets if not t.endswith('.dwo')]
         toolPath = myEnv.WhereIs('$'+(tool if tool != "ACC" else "CC"))
         assert toolPath, 'Unable to find the location of tool "%s"' % tool
 
@@ -1131,13 +1993,18 @@ class NinjaFile(object):
         ninja.comment('-*- eval: (auto-fill-mode -1) -*-')
         with open(self.ninja_file, 'w') as f:
             f.write(content.getvalue())
+        ninja_log.write_edges(self.edges_file, self.builds)
+        if self.compile_db:
+            self.write_compile_db()
         if self.globalEnv['NINJA'] and not self.globalEnv.TargetOSIs('windows'):
             os.chmod(self.ninja_file, 0o755)
 
     def write_vars(self, ninja):
-        # We can probably drop this to 1.5, but I've only tested with 1.7.
+        # We can probably drop the minimum to 1.5, but I've only tested with 1.7.
         ninja.newline()
-        ninja.variable('ninja_required_version', '1.7')
+        required = max([[1, 7]] + [NINJA_FEATURES[f][0] for f in self.ninja_features
+                                   if NINJA_FEATURES[f][1]])
+        ninja.variable('ninja_required_version', '.'.join(str(part) for part in required))
         if GetOption('ninja_builddir'):
             ninja.variable('builddir', GetOption('ninja_builddir'))
 
@@ -1154,6 +2021,91 @@ class NinjaFile(object):
             for num, val in sorted((num, val) for (val, num) in self.overrides[name].items()):
                 ninja.variable('%s_%s'%(name, num), val)
 
+    def recorded_rss(self):
+        """Returns the peak RSS in KiB that the edge launcher recorded for each output."""
+        if not hasattr(self, '_recorded_rss'):
+            self._recorded_rss = {}
+            if os.path.exists(self.resource_log):
+                self._recorded_rss = ninja_log.read_rss(self.resource_log)
+        return self._recorded_rss
+
+    def assign_compile_pools(self):
+        # A few compiles, like the mozjs unified TUs and the SLOW_TU_PARTS, each need several GB
+        # of memory. Running as many of those at once as other compiles would run out of memory
+        # at -j equal to the number of cores, while limiting all compiles to what those need would
+        # leave cores idle. So they get their own pool with a depth based on their recorded peak
+        # memory, and everything else shares what is left.
+        recorded_rss = self.recorded_rss()
+        durations = {}
+        log = os.path.join(self.builddir, '.ninja_log')
+        if os.path.exists(log):
+            for entry in ninja_log.read_log(log, last_build_only=False):
+                durations[entry.output] = entry.end - entry.start
+
+        heavy_peak = light_peak = 0
+        for build in self.builds:
+            if build['rule'] not in COMPILE_RULES:
+                continue
+            output = ninja_syntax.as_list(build['outputs'])[0]
+            rss = recorded_rss.get(output)
+            if rss is not None:
+                heavy = rss >= HEAVY_COMPILE_RSS_KB
+            else:
+                # ccache hits make the durations useless to tell that a compile is light.
+                heavy = (durations.get(output, 0) >= HEAVY_COMPILE_MS
+                         or any(s in output for s in SLOW_TU_PARTS))
+                rss = DEFAULT_HEAVY_COMPILE_RSS_KB if heavy else DEFAULT_LIGHT_COMPILE_RSS_KB
+            pool = 'heavy_compile' if heavy else 'light_compile'
+            build.setdefault('variables', {})['pool'] = pool
+            if heavy:
+                heavy_peak = max(heavy_peak, rss)
+            else:
+                light_peak = max(light_peak, rss)
+
+        cpus = multiprocessing.cpu_count()
+        available_kb = available_memory_kb()
+        if available_kb is None:
+            self.compile_pools = {'heavy_compile': cpus, 'light_compile': cpus}
+            return
+        # Heavy compiles can use up to half of the memory, and light compiles the rest.
+        heavy_depth = max(1, min(cpus, available_kb // 2 // max(heavy_peak, 1)))
+        light_depth = max(1, min(cpus, (available_kb - heavy_depth * heavy_peak)
+                                       // max(light_peak, 1)))
+        self.compile_pools = {'heavy_compile': heavy_depth, 'light_compile': light_depth}
+
+    def link_pool_depth(self):
+        """Returns how many links can run at once without running out of memory."""
+        if GetOption('link-pool-depth'):
+            return GetOption('link-pool-depth')
+
+        # Without a record of what links here need, assume they are about as big as mongod with
+        # debug info.
+        recorded_rss = self.recorded_rss()
+        recorded = [recorded_rss[output]
+                    for build in self.builds if build['rule'] in ('LINK', 'SHLINK')
+                    for output in ninja_syntax.as_list(build['outputs'])
+                    if output in recorded_rss]
+        peak_kb = max(recorded) if recorded else DEFAULT_LINK_RSS_KB
+
+        available_kb = available_memory_kb()
+        if available_kb is None:
+            return multiprocessing.cpu_count()
+        return max(1, min(multiprocessing.cpu_count(), available_kb // peak_kb))
+
+    def launcher(self, cutoff=False, cache=False):
+        """Returns the prefix that runs a rule's command through the edge launcher, if needed."""
+        flags = []
+        if self.track_resources:
+            flags += ['--log', self.resource_log]
+        if cutoff:
+            flags.append('--cutoff')
+        if cache and self.action_cache:
+            flags += ['--cache', self.action_cache,
+                      '--cache-size', GetOption('ninja_action_cache_size')]
+        if not flags:
+            return ''
+        return '$PYTHON -S %s %s $out ' % (edge_launcher_script, ' '.join(flags))
+
     def write_rules(self, ninja):
         ninja.newline()
 
@@ -1178,7 +2130,7 @@ class NinjaFile(object):
                 description = 'MAKE_ICECC_ENV $out')
 
         ninja.rule('RUN_TEST',
-                command='$in',
+                command=self.launcher() + '$in',
                 description='RUN_TEST $in',
                 pool='console') # show live output.
 
@@ -1192,21 +2144,62 @@ class NinjaFile(object):
                 rspfile_content = '$in',
                 )
 
-        ninja.rule('INSTALL',
-                command = '$COPY $in $out',
+        run_script = '$PYTHON'
+        if self.helper_socket:
+            # Run the scripts in a long-lived process rather than starting python for each one.
+            run_script = '$PYTHON -S %s %s' % (ninja_helper_script, self.helper_socket)
+
+        if GetOption('ninja_install') == 'link':
+            # Installed files keep the mtime of their source, and an unchanged one isn't touched.
+            ninja.rule('INSTALL',
+                    command = '%s %s $in $out' % (run_script, install_file_script),
+                    pool=local_pool,
+                    restat=1,
+                    description = 'INSTALL $out')
+        else:
+            ninja.rule('INSTALL',
+                    command = '$COPY $in $out',
+                    pool=local_pool,
+                    description = 'INSTALL $out')
+
+        # Copy keeps the source's mode, which install would replace. cp only gives a file it
+        # creates the source's mode, so remove the old copy first. That also lets cp -P replace a
+        # symlink.
+        ninja.rule('COPY_FILE',
+                command = ('$COPY $in $out' if self.globalEnv.TargetOSIs('windows')
+                           else 'rm -f $out && cp -P $in $out'),
                 pool=local_pool,
-                description = 'INSTALL $out')
+                description = 'COPY $out')
+
+        if self.generated_header_groups:
+            # The dyndep files are written when build.ninja is, so they need no log entry.
+            ninja.rule('HEADER_DYNDEP',
+                command = run_script + ' $script $out $out.rsp',
+                pool=local_pool,
+                rspfile = '$out.rsp',
+                rspfile_content = '$rspfile_content',
+                generator = 1,
+                description = 'DYNDEP $out')
 
         ninja.rule('SCRIPT_RSP',
-            command = '$PYTHON $script $in $out $out.rsp',
+            command = run_script + ' $script $in $out $out.rsp',
             pool=local_pool,
             rspfile = '$out.rsp',
             rspfile_content = '$rspfile_content',
             restat = 1,
             description = "GEN $out")
 
+        if self.batch_subst:
+            ninja.rule('SCRIPT_BATCH_RSP',
+                command = run_script + ' $script --batch $rsp',
+                pool=local_pool,
+                rspfile = '$rsp',
+                rspfile_content = '$rspfile_content',
+                restat = 1,
+                description = "GEN $count files")
+
         ninja.rule("COMPILER_TIMESTAMPS",
-            command="$PYTHON %s $in $out"%(touch_compiler_timestamps_script),
+            command="%s %s $in $out"%(run_script, touch_compiler_timestamps_script),
             pool=local_pool,
             restat=1,
             description="Checking for compiler upgrades")
@@ -1217,64 +2210,69 @@ class NinjaFile(object):
             description = 'SCONSGEN $out',
             restat=1)
 
-        if self.globalEnv['NINJA']:
-            cmd = self.globalEnv['NINJA'] + ' -f $in -t compdb CXX CC SHCXX SHCC > $out.tmp'
-            if self.globalEnv.TargetOSIs('windows'):
-                cmd = 'cmd /c ' + cmd + ' && move /y $out.tmp $out'
-            else:
-                cmd = cmd + ' && mv -f $out.tmp $out'
-            ninja.rule('COMPILE_DB',
-                    command = cmd,
-                    pool=local_pool,
-                    description = 'COMPILE_DB $out')
+        for name, depth in sorted(self.compile_pools.items()):
+            ninja.pool(name, depth)
 
         if self.globalEnv.ToolchainIs('gcc', 'clang'):
+            link_launcher = self.launcher(cache=True)
+            compile_launcher = self.launcher(cutoff=self.cutoff)
             # ninja ignores leading spaces so this will work fine if empty.
             if 'CXX' in self.tool_commands:
                 ninja.rule('CXX',
                     deps = 'gcc',
                     depfile = '$out.d',
-                    command = '%s -MMD -MF $out.d'%(self.tool_commands['CXX']),
+                    command = compile_launcher + '%s -MMD -MF $out.d'%(self.tool_commands['CXX']),
                     pool=compile_pool,
+                    restat=self.cutoff,
                     description = 'CXX $out')
             if 'SHCXX' in self.tool_commands:
                 ninja.rule('SHCXX',
                     deps = 'gcc',
                     depfile = '$out.d',
-                    command = '%s -MMD -MF $out.d'%(self.tool_commands['SHCXX']),
+                    command = compile_launcher + '%s -MMD -MF $out.d'%(self.tool_commands['SHCXX']),
                     pool=compile_pool,
+                    restat=self.cutoff,
                     description = 'SHCXX $out')
             if 'CC' in self.tool_commands:
                 ninja.rule('CC',
                     deps = 'gcc',
                     depfile = '$out.d',
-                    command = '%s -MMD -MF $out.d'%(self.tool_commands['CC']),
+                    command = compile_launcher + '%s -MMD -MF $out.d'%(self.tool_commands['CC']),
                     pool=compile_pool,
+                    restat=self.cutoff,
                     description = 'CC $out')
             if 'ACC' in self.tool_commands:
                 ninja.rule('ACC',
                     deps = 'gcc',
                     depfile = '$out.d',
-                    command = '%s -MMD -MF $out.d'%(self.tool_commands['CC']),
+                    command = compile_launcher + '%s -MMD -MF $out.d'%(self.tool_commands['CC']),
                     pool=compile_pool,
+                    restat=self.cutoff,
                     description = 'ACC $out')
             if 'SHCC' in self.tool_commands:
                 ninja.rule('SHCC',
                     deps = 'gcc',
                     depfile = '$out.d',
-                    command = '%s -MMD -MF $out.d'%(self.tool_commands['SHCC']),
+                    command = compile_launcher + '%s -MMD -MF $out.d'%(self.tool_commands['SHCC']),
                     pool=compile_pool,
+                    restat=self.cutoff,
                     description = 'SHCC $out')
+            link_pool = local_pool
+            if self.globalEnv.TargetOSIs('linux'):
+                # Links are the largest consumers of memory in the build, so running too many at
+                # once can push the machine into swap or the OOM killer.
+                link_pool = 'link'
+                ninja.pool('link', self.link_pool_depth())
             if 'SHLINK' in self.tool_commands:
                 command = self.tool_commands['SHLINK']
                 i = command.find('$SHLINK ') + len('$SHLINK')
                 prefix = command[:i]
                 args = command[i + 1:]
                 ninja.rule('SHLINK',
-                    command = prefix + ' @$out.rsp',
+                    command = link_launcher + prefix + ' @$out.rsp',
                     rspfile = '$out.rsp',
                     rspfile_content = args,
-                    pool=local_pool,
+                    pool=link_pool,
                     description = 'DYNLIB $out')
             if 'LINK' in self.tool_commands:
                 command = self.tool_commands['LINK']
@@ -1282,17 +2280,25 @@ class NinjaFile(object):
                 prefix = command[:i]
                 args = command[i + 1:]
                 ninja.rule('LINK',
-                    command = prefix + ' @$out.rsp',
+                    command = link_launcher + prefix + ' @$out.rsp',
                     rspfile = '$out.rsp',
                     rspfile_content = args,
-                    pool=local_pool,
+                    pool=link_pool,
                     description = 'LINK $out')
             if 'AR' in self.tool_commands:
                 # We need to remove $out because the file existing can confuse ar. This is particularly
                 # a problem when switching between thin and non-thin archive files.
+                command = 'rm -f $out && ' + self.tool_commands['AR']
+                # A thin archive only lists its members, so it doesn't change when they do.
+                ar_cutoff = self.cutoff and not uses_thin_archives(self.globalEnv)
+                if ar_cutoff or self.action_cache:
+                    # The launcher removes $out itself.
+                    command = (self.launcher(cutoff=ar_cutoff, cache=True)
+                               + self.tool_commands['AR'])
                 ninja.rule('AR',
-                    command = 'rm -f $out && ' + self.tool_commands['AR'],
+                    command = command,
                     pool=local_pool,
+                    restat=ar_cutoff,
                     description = 'STATICLIB $out')
 
             ninja.rule('SYMLINK',
@@ -1327,7 +2333,7 @@ class NinjaFile(object):
                     command = self.tool_commands['AR'],
                     description = 'STATICLIB $out')
             if 'LINK' in self.tool_commands:
-                ninja.pool('winlink', GetOption('link-pool-depth'))
+                ninja.pool('winlink', GetOption('link-pool-depth') or 4)
                 ninja.rule('LINK',
                     command = 'cmd /c $PYTHON %s $out.rsp && $LINK @$out.rsp'%split_lines_script,
                     rspfile = '$out.rsp',
@@ -1336,7 +2342,7 @@ class NinjaFile(object):
                     description = 'LINK $out')
             if 'SHLINK' in self.tool_commands:
                 if 'LINK' not in self.tool_commands:
-                    ninja.pool('winlink', GetOption('link-pool-depth'))
+                    ninja.pool('winlink', GetOption('link-pool-depth') or 4)
                 # Workaround mslink.py's dll handling by transforming $out to switch to link.exe
                 ninja.rule('SHLINK',
                     command = 'cmd /c $PYTHON %s $out.rsp && $SHLINK @$out.rsp'%split_lines_script,
@@ -1362,8 +2368,94 @@ class NinjaFile(object):
 
         ninja.newline()
         ninja.build('_generated_headers', 'phony', sorted(self.generated_headers))
+        for group in sorted(self.generated_header_groups):
+            ninja.build(group, 'phony', sorted(self.generated_header_groups[group]))
         ninja.build('_ALWAYS_BUILD', 'phony')
 
+    def expand(self, text, lookup):
+        # Expands $vars like ninja does. lookup returns the already expanded value of a variable.
+        def expand_var(m):
+            if m.group(1) in ('$', ' ', ':'):
+                return m.group(1)
+            return lookup(m.group(2) or m.group(3))
+        return re.sub(r'\$(\$| |:|\{([^}]*)\}|([a-zA-Z0-9_-]+))', expand_var, text)
+
+    def expand_global(self, name):
+        # Values in self.vars are escaped when written, but the overrides are written as-is.
+        if name in self.vars:
+            return self.vars[name]
+        if name not in self.expanded_overrides:
+            base, _, num = name.rpartition('_')
+            value = ''
+            for val, n in self.overrides.get(base, {}).items():
+                if str(n) == num:
+                    value = self.expand(val, self.expand_global)
+            self.expanded_overrides[name] = value
+        return self.expanded_overrides[name]
+
+    def expand_build_command(self, command, build):
+        def lookup(name):
+            if name == 'in':
+                return ' '.join(ninja_syntax.as_list(build['inputs']))
+            if name == 'out':
+                return ' '.join(ninja_syntax.as_list(build['outputs']))
+            if name in build.get('variables', {}):
+                return self.expand(build['variables'][name], self.expand_global)
+            return self.expand_global(name)
+        return self.expand(command, lookup)
+
+    def compile_db_entries(self):
+        # Unlike `ninja -t compdb`, this leaves out the ccache and icecream wrappers and the flags
+        # that ninja uses to track header dependencies, so tools see the real compiler. On posix,
+        # commands are pre-split into arguments so tools don't need to parse them.
+        directory = os.getcwd()
+        posix = self.globalEnv.TargetOSIs('posix')
+        self.expanded_overrides = {}
+        for build in self.builds:
+            if build['rule'] not in ('CXX', 'CC', 'SHCXX', 'SHCC'):
+                continue
+            entry = dict(
+                directory=directory,
+                file=ninja_syntax.as_list(build['inputs'])[0],
+                output=ninja_syntax.as_list(build['outputs'])[0])
+            command = self.expand_build_command(
+                    self.compile_db_commands.get(build['rule'], self.tool_commands[build['rule']]),
+                    build)
+            if posix:
+                entry['arguments'] = shlex.split(command)
+            else:
+                entry['command'] = command
+            yield entry
+
+    def write_compile_db(self):
+        # Entries are written one per line so tools can stream the file rather than parsing it
+        # all at once, and files are only rewritten when they change so tools watching them don't
+        # needlessly reload.
+        layout = GetOption('ninja_compdb_layout') or 'single'
+        lines = sorted(json.dumps(entry, sort_keys=True) for entry in self.compile_db_entries())
+        write_if_changed(self.compile_db, '[\n' + ',\n'.join(lines) + '\n]\n')
+
+        if layout == 'stream':
+            write_if_changed(splitext(self.compile_db)[0] + '.jsonl',
+                             ''.join(line + '\n' for line in lines))
+
+        if layout == 'split':
+            # One db per source directory so tools that only care about part of the tree can load
+            # just that part.
+            by_dir = {}
+            for line in lines:
+                by_dir.setdefault(os.path.dirname(json.loads(line)['file']), []).append(line)
+            split_root = os.path.join('build', 'compiledb')
+            wanted = set()
+            for dir, dir_lines in by_dir.items():
+                path = os.path.join(split_root, dir, 'compile_commands.json')
+                wanted.add(os.path.normpath(path))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_if_changed(path, '[\n' + ',\n'.join(dir_lines) + '\n]\n')
+            for path in rglob('compile_commands.json', split_root):
+                if os.path.normpath(path) not in wanted:
+                    os.remove(path)
+
     def write_regenerator(self, ninja):
         deps = flatten([
             'SConstruct',
@@ -1374,7 +2466,8 @@ class NinjaFile(object):
             rglob('*.py', 'src/third_party/scons-2.5.0'),
             rglob('*.py', 'src/mongo/db/modules'),
             [self.globalEnv.WhereIs(tool) for tool in self.tool_paths],
-            self.compiler_timestamp_file,
+            self.globalEnv['NINJA'], # Features depend on its version.
+            self.compiler_timestamp_files,
             self.rc_files, # We rely on scons to tell us the deps of windows rc files.
             ])
 
@@ -1402,14 +2495,13 @@ class NinjaFile(object):
             restat=1)
         ninja.build(self.ninja_file, 'GENERATOR')
 
-def configure(conf, env):
-
+def add_options(env):
+    """Adds the module's command line options. Also called by benchmarks/ninja_gen_bench.py."""
     env.AddOption('link-pool-depth',
-            default=4,
             type='int',
             action='store',
             dest='link-pool-depth',
-            help='WINDOWS ONLY: limit of concurrent links (default 4)')
+            help='Limit of concurrent links (default 4 on Windows, based on free memory on Linux)')
 
     env.AddOption('ninja-builddir',
             type='str',
@@ -1424,6 +2516,103 @@ def configure(conf, env):
             dest='icecream',
             help='Use the icecream distributed compile server')
 
+    env.AddOption('icecream-mirror',
+            type='str',
+            action='store',
+            dest='icecream_mirror',
+            help='DARWIN ONLY: url or local directory to fetch the icecream toolchain from')
+
+    env.AddOption('ccache-remote-storage',
+            type='str',
+            action='store',
+            dest='ccache_remote_storage',
+            help='Use this ccache remote (secondary) storage url, requires ccache >= 4.2')
+
+    env.AddOption('ccache-normalize-paths',
+            default=False,
+            action='store_true',
+            dest='ccache_normalize_paths',
+            help='Make ccache hashes independent of the checkout location')
+
+    env.AddOption('ninja-cache-report',
+            default=False,
+            action='store_true',
+            dest='ninja_cache_report',
+            help='Add a cache_report target that reports ccache hits and misses, ccache >= 4.0')
+
+    env.AddOption('ninja-compdb-layout',
+            type='choice',
+            choices=['single', 'split', 'stream'],
+            default='single',
+            action='store',
+            dest='ninja_compdb_layout',
+            help='Also write compile_commands.json per directory (split) or as json lines (stream)')
+
+    env.AddOption('ninja-batch-subst',
+            default=False,
+            action='store_true',
+            dest='ninja_batch_subst',
+            help='Generate all independent Substfile targets with a single python process')
+
+    env.AddOption('ninja-batch-scons',
+            default=False,
+            action='store_true',
+            dest='ninja_batch_scons',
+            help='Build all independent targets that need scons with a single scons process')
+
+    env.AddOption('ninja-helper',
+            default=False,
+            action='store_true',
+            dest='ninja_helper',
+            help='NOT WINDOWS: Run the python helper scripts in a long-lived server process')
+
+    env.AddOption('ninja-fast-link',
+            default=False,
+            action='store_true',
+            dest='ninja_fast_link',
+            help='LINUX ONLY: Use split dwarf, a faster linker and thin archives where supported')
+
+    env.AddOption('ninja-install',
+            type='choice',
+            choices=['copy', 'link'],
+            default='copy',
+            action='store',
+            dest='ninja_install',
+            help='NOT WINDOWS: Install by copying, or as a reflink or hardlink where possible (link)')
+
+    env.AddOption('ninja-fine-header-deps',
+            default=False,
+            action='store_true',
+            dest='ninja_fine_header_deps',
+            help='Let compiles start before generated headers they did not use last build. '
+                 'Needs ninja >= 1.11')
+
+    env.AddOption('ninja-cutoff',
+            default=False,
+            action='store_true',
+            dest='ninja_cutoff',
+            help='NOT WINDOWS: Skip relinking when recompiled objects and archives are unchanged')
+
+    env.AddOption('ninja-action-cache',
+            type='str',
+            action='store',
+            dest='ninja_action_cache',
+            help='NOT WINDOWS: Cache the outputs of links and archives in this directory')
+
+    env.AddOption('ninja-action-cache-size',
+            type='str',
+            default='20G',
+            action='store',
+            dest='ninja_action_cache_size',
+            help='Maximum size of the --ninja-action-cache directory (default 20G)')
+
+    env.AddOption('ninja-track-resources',
+            default=False,
+            action='store_true',
+            dest='ninja_track_resources',
+            help='LINUX ONLY: Record what each compile, link and test used, to size pools and for'
+                ' the build_report target')
+
     env.AddOption('pch',
             default=False,
             action='store_true',
@@ -1442,6 +2631,9 @@ def configure(conf, env):
             dest='enable_dwarf64',
             help='If enabled, stop stripping -gdwarf64 from the build (incompatible with lldb)')
 
+def configure(conf, env):
+    add_options(env)
+
     if not COMMAND_LINE_TARGETS:
         print("*** ERROR: To prevent PEBKACs, the ninja module requires that you pass a target to scons.")
         print("*** You probably forgot to include build.ninja on the command line")
@@ -1483,9 +2675,40 @@ def configure(conf, env):
         print("*** Use --icecream instead.")
         Exit(1)
 
+    launcher_options = [o for o in ('ninja_track_resources', 'ninja_cutoff', 'ninja_action_cache')
+                        if GetOption(o)]
+    if launcher_options and sys.version_info < EDGE_LAUNCHER_MIN_PYTHON:
+        # These run commands through edge_launcher.py with $PYTHON, the python running scons.
+        print("*** ERROR: --%s needs python >= %s." % (
+            launcher_options[0].replace('_', '-'), '.'.join(map(str, EDGE_LAUNCHER_MIN_PYTHON))))
+        Exit(1)
+
+    if GetOption('ninja_track_resources') and not env.TargetOSIs('linux'):
+        print("*** ERROR: --ninja-track-resources is only supported on Linux.")
+        Exit(1)
+
+    if GetOption('ninja_cutoff') and env.TargetOSIs('windows'):
+        print("*** ERROR: --ninja-cutoff is not supported on Windows.")
+        Exit(1)
+
+    if GetOption('ninja_action_cache') and env.TargetOSIs('windows'):
+        print("*** ERROR: --ninja-action-cache is not supported on Windows.")
+        Exit(1)
+
+    if GetOption('ninja_install') == 'link' and env.TargetOSIs('windows'):
+        print("*** ERROR: --ninja-install=link is not supported on Windows.")
+        Exit(1)
+
+    if GetOption('ninja_helper') and env.TargetOSIs('windows'):
+        print("*** ERROR: --ninja-helper is not supported on Windows.")
+        Exit(1)
+
     env['NINJA'] = where_is(env, 'ninja')
     if not env['NINJA']:
         env['NINJA'] = where_is(env, 'ninja-build') # Fedora...
+    # Newer ninja versions let us describe some outputs more accurately. Without one, assume the
+    # oldest supported version.
+    env['_NINJA_VERSION'] = ninja_version(env['NINJA']) if env['NINJA'] else []
 
     # This is checking if we have a version of errorcodes.py that supports the --list-files flag
     # needed to correctly handle the dependencies in ninja. This will be re-run when changing to
@@ -1510,6 +2733,12 @@ def configure(conf, env):
         # ninja filter out the colors if the real stdout is redirected.
         env.Append(CCFLAGS=["-fdiagnostics-color=always"])
 
+        if GetOption('ninja_fast_link'):
+            if not env.TargetOSIs('linux'):
+                print("*** ERROR: --ninja-fast-link is only supported on Linux.")
+                Exit(1)
+            set_up_fast_link(env)
+
         using_gsplitdwarf = any('-gsplit-dwarf' in env[var]
                                 for var in ('CCFLAGS', 'CFLAGS', 'CXXFLAGS'))
 
@@ -1544,12 +2773,28 @@ def configure(conf, env):
                 print('***')
                 Exit(1)
 
-            ccache_version_raw = (subprocess.check_output([env['_NINJA_CCACHE'], '--version'])
-                                            .decode('utf8')
-                                            .split('\n', 1)[0]
-                                            .split()[-1]
-                                            .split('+')[0])
-            env['_NINJA_CCACHE_VERSION'] = [int(s) for s in ccache_version_raw.split('.')]
+            env['_NINJA_CCACHE_VERSION'] = ccache_config.version(env['_NINJA_CCACHE'])
+
+            remote_storage = GetOption('ccache_remote_storage')
+            if remote_storage and not ccache_config.remote_storage_var(env['_NINJA_CCACHE_VERSION']):
+                print("*** ERROR: --ccache-remote-storage requires ccache >= 4.2")
+                Exit(1)
+
+            basedir = None
+            if GetOption('ccache_normalize_paths'):
+                # Make everything relative to the checkout so that builds from different
+                # directories (and machines) can share cache entries. The debug info would still
+                # contain the absolute compile directory without the prefix map.
+                basedir = Dir('#').abspath
+                env.Append(CCFLAGS=['-fdebug-prefix-map=%s=.' % basedir])
+
+            if GetOption('ninja_cache_report') and env['_NINJA_CCACHE_VERSION'] < [4, 0]:
+                print("*** ERROR: --ninja-cache-report requires ccache >= 4.0")
+                Exit(1)
+
+            env['_NINJA_CCACHE_ENV'] = ccache_config.rule_env(env['_NINJA_CCACHE_VERSION'],
+                                                              basedir,
+                                                              remote_storage)
 
             if using_gsplitdwarf:
                 if env['_NINJA_CCACHE_VERSION']  < [3, 2, 3]:
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Summarizes what the last build spent its time and resources on:
+#
+#   * the cpu time, peak memory, I/O and failures per rule and per directory, and the top
+#     consumers, from the log that edge_launcher.py writes with --ninja-track-resources
+#   * how many edges were running over the course of the build, from .ninja_log
+#   * the critical path, the chain of dependent edges that took the longest, from .ninja_log and
+#     the .ninja_edges.json file that build.py writes
+#
+#   build_report.py ninja_log edges resource_log
+
+import collections
+import os
+import sys
+
+import ninja_log
+
+HISTOGRAM_BUCKETS = 40
+HISTOGRAM_WIDTH = 60
+
+def last_build_resources(resource_log, outputs):
+    """Returns the last Resources of each output that was built in the last build."""
+    resources = {}
+    if os.path.exists(resource_log):
+        for entry in ninja_log.read_resources(resource_log):
+            if entry.output in outputs:
+                resources[entry.output] = entry
+    return resources
+
+def rule_of(edges, output):
+    edge = edges.get(output)
+    if edge:
+        return edge.rule
+    # Test runs aren't in the edge map when scons adds them.
+    return 'RUN_TEST' if output.startswith('+') else 'unknown'
+
+def show_consumers(resources, edges, top=15):
+    def totals(key):
+        groups = collections.defaultdict(lambda: [0, 0, 0, 0, 0])
+        for entry in resources.values():
+            group = groups[key(entry)]
+            group[0] += 1
+            group[1] += entry.user_ms + entry.sys_ms
+            group[2] = max(group[2], entry.max_rss)
+            group[3] += entry.read_bytes + entry.write_bytes
+            group[4] += entry.status != 0
+        return groups
+
+    def show_totals(title, groups, limit=None):
+        print('%-40s %7s %10s %10s %10s %6s' % (title, 'edges', 'cpu (s)', 'max rss MB',
+                                                 'I/O MB', 'failed'))
+        by_cpu = sorted(groups.items(), key=lambda g: -g[1][1])
+        for name, (count, cpu_ms, rss, io, failed) in by_cpu[:limit]:
+            print('%-40s %7d %10.1f %10.0f %10.0f %6d' % (name[-40:], count, cpu_ms / 1000.0,
+                                                          rss / 1024.0, io / 1e6, failed))
+        print()
+
+    show_totals('rule', totals(lambda e: rule_of(edges, e.output)))
+    show_totals('directory', totals(lambda e: os.path.dirname(e.output) or '.'), top)
+
+    print('Most cpu time:')
+    for entry in sorted(resources.values(), key=lambda e: -(e.user_ms + e.sys_ms))[:top]:
+        print('%8.1fs  %s' % ((entry.user_ms + entry.sys_ms) / 1000.0, entry.output))
+    print()
+    print('Largest peak memory:')
+    for entry in sorted(resources.values(), key=lambda e: -e.max_rss)[:top]:
+        print('%8.0fMB  %s' % (entry.max_rss / 1024.0, entry.output))
+    failed = [entry for entry in resources.values() if entry.status != 0]
+    if failed:
+        print()
+        print('Failed:')
+        for entry in failed:
+            print('%8s  %s' % ('signal %d' % -entry.status if entry.status < 0
+                               else 'exit %d' % entry.status, entry.output))
+    print()
+
+def show_parallelism(entries):
+    """Prints a histogram of how many edges were running on average over the build."""
+    start = min(e.start for e in entries)
+    end = max(e.end for e in entries)
+    bucket_ms = max(1.0, (end - start) / float(HISTOGRAM_BUCKETS))
+    busy = [0.0] * HISTOGRAM_BUCKETS
+    for entry in entries:
+        # Spread each edge's time over the buckets it overlaps.
+        first = int((entry.start - start) / bucket_ms)
+        last = min(HISTOGRAM_BUCKETS - 1, int((entry.end - start) / bucket_ms))
+        for bucket in range(first, last + 1):
+            lo = max(entry.start, start + bucket * bucket_ms)
+            hi = min(entry.end, start + (bucket + 1) * bucket_ms)
+            if hi > lo:
+                busy[bucket] += hi - lo
+
+    running = [b / bucket_ms for b in busy]
+    scale = HISTOGRAM_WIDTH / max(max(running), 1.0)
+    print('Edges running over %.1fs (average %.1f):' % (
+        (end - start) / 1000.0, sum(busy) / float(end - start or 1)))
+    for bucket, count in enumerate(running):
+        print('%7.1fs %6.1f %s' % (bucket * bucket_ms / 1000.0, count, '#' * int(count * scale)))
+    print()
+
+def critical_path(entries, edges):
+    """Returns the outputs on the longest chain of dependent edges in the build, in order."""
+    durations = dict((e.output, e.end - e.start) for e in entries)
+
+    def deps_of(output):
+        # Phony aliases such as _generated_headers take no time but chain their inputs to what
+        # depends on them.
+        edge = edges.get(output)
+        return [d for d in (edge.inputs + edge.deps if edge else [])
+                if d in durations or (d in edges and edges[d].rule == 'phony')]
+
+    # The longest chain ending with each output, computed deps first without recursing since
+    # the graph is too deep for python's stack. Each output is pushed once to expand its deps and
+    # once more, beneath them, to be finished after all of them are.
+    best = {}
+    for root in durations:
+        stack = [(root, False)]
+        expanding = set()
+        while stack:
+            output, expanded = stack.pop()
+            if output in best:
+                continue
+            if expanded:
+                expanding.discard(output)
+                # Deps still missing from best are only reachable through a cycle.
+                deps = [d for d in deps_of(output) if d in best]
+                prev = max(deps, key=lambda d: best[d][0], default=None)
+                best[output] = (durations.get(output, 0) + (best[prev][0] if prev else 0), prev)
+            elif output not in expanding:
+                expanding.add(output)
+                stack.append((output, True))
+                stack.extend((d, False) for d in deps_of(output) if d not in best)
+
+    output = max(best, key=lambda o: best[o][0], default=None)
+    path = []
+    while output:
+        if output in durations:
+            path.append(output)
+        output = best[output][1]
+    return list(reversed(path)), durations
+
+def show_critical_path(entries, edges):
+    path, durations = critical_path(entries, edges)
+    print('Critical path (%.1fs):' % (sum(durations[o] for o in path) / 1000.0))
+    for output in path:
+        print('%8.1fs  %-8s %s' % (durations[output] / 1000.0, rule_of(edges, output), output))
+
+def main(argv):
+    if len(argv) != 4:
+        print(argv[0] + ': ninja_log edges resource_log')
+        return 1
+
+    log_file, edges_file, resource_log = argv[1:]
+    entries = ninja_log.read_log(log_file) if os.path.exists(log_file) else []
+    if not entries:
+        print('Nothing has been built yet.')
+        return 0
+    edges = ninja_log.read_edges(edges_file) if os.path.exists(edges_file) else {}
+
+    resources = last_build_resources(resource_log, set(e.output for e in entries))
+    if resources:
+        show_consumers(resources, edges)
+    else:
+        print('No resource usage was recorded. Pass --ninja-track-resources to scons.')
+        print()
+    show_parallelism(entries)
+    show_critical_path(entries, edges)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# Reports how the compiles since the last report used ccache and how much time the misses cost.
+#
+# ccache appends the result of each compile to its stats log (CCACHE_STATSLOG), which is joined
+# with the compile durations from .ninja_log. The log is rotated after each report, and the
+# `ccache --print-stats` counters are compared to a snapshot from the previous report.
+
+import collections
+import json
+import os
+import subprocess
+import sys
+
+import ninja_log
+
+HIT_RESULTS = ('direct_cache_hit', 'preprocessed_cache_hit')
+MISS_RESULTS = ('cache_miss',)
+COMPILE_RULES = ('CC', 'CXX', 'SHCC', 'SHCXX')
+
+def read_stats_log(path):
+    """Returns a dict from each compiled file to its list of ccache result ids."""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    current = None
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('# '):
+                current = results.setdefault(line[2:], [])
+                del current[:] # Only keep the last compile of each file.
+            elif line and current is not None:
+                current.append(line)
+    return results
+
+def classify(result_ids):
+    if any(r in HIT_RESULTS for r in result_ids):
+        return 'hit', None
+    if any(r in MISS_RESULTS for r in result_ids):
+        return 'miss', None
+    return 'uncacheable', result_ids[0] if result_ids else 'unknown'
+
+def print_stats(ccache):
+    output = subprocess.check_output([ccache, '--print-stats']).decode('utf8')
+    return dict((k, int(v)) for k, v in (line.split('\t', 1)
+                                         for line in output.splitlines() if '\t' in line)
+                if v.strip().isdigit())
+
+def report(ccache, log_file, edges_file, stats_log, snapshot_file, top=20):
+    edges = ninja_log.read_edges(edges_file)
+    by_source = {}
+    for output, edge in edges.items():
+        if edge.rule in COMPILE_RULES and edge.inputs:
+            by_source[edge.inputs[0]] = output
+
+    durations = {}
+    if os.path.exists(log_file):
+        for entry in ninja_log.read_log(log_file, last_build_only=False):
+            durations[entry.output] = entry.end - entry.start
+
+    per_rule = collections.defaultdict(collections.Counter)
+    miss_time = collections.Counter()
+    unhelped = []
+    for source, result_ids in read_stats_log(stats_log).items():
+        output = by_source.get(os.path.relpath(source) if os.path.isabs(source) else source)
+        rule = edges[output].rule if output else 'unknown'
+        kind, reason = classify(result_ids)
+        per_rule[rule][kind] += 1
+        if kind != 'hit':
+            duration = durations.get(output, 0)
+            miss_time[rule] += duration
+            unhelped.append((duration, kind, reason, output or source))
+
+    print('%-8s %8s %8s %12s %14s' % ('rule', 'hits', 'misses', 'uncacheable', 'miss time (s)'))
+    for rule in sorted(per_rule):
+        counts = per_rule[rule]
+        print('%-8s %8d %8d %12d %14.1f' % (rule, counts['hit'], counts['miss'],
+                                            counts['uncacheable'], miss_time[rule] / 1000.0))
+
+    if unhelped:
+        print()
+        print('Slowest compiles that missed or could not use the cache:')
+        for duration, kind, reason, name in sorted(unhelped, reverse=True)[:top]:
+            print('%8.1fs  %-12s %s%s' % (duration / 1000.0, kind, name,
+                                          ' (%s)' % reason if reason else ''))
+
+    current = print_stats(ccache)
+    previous = {}
+    if os.path.exists(snapshot_file):
+        with open(snapshot_file) as f:
+            previous = json.load(f)
+    changed = sorted((k, v - previous.get(k, 0)) for k, v in current.items()
+                     if v != previous.get(k, 0) and not k.startswith('stats_'))
+    if changed:
+        print()
+        print('ccache counters since the last report:')
+        for name, delta in changed:
+            print('%10d  %s' % (delta, name))
+
+    # Start a new reporting window.
+    with open(snapshot_file + '.tmp', 'w') as f:
+        json.dump(current, f)
+    os.replace(snapshot_file + '.tmp', snapshot_file)
+    if os.path.exists(stats_log):
+        os.replace(stats_log, stats_log + '.old')
+
+if __name__ == '__main__':
+    if len(sys.argv) != 6:
+        print(sys.argv[0] + ': ccache ninja_log edges stats_log snapshot')
+        sys.exit(1)
+    report(*sys.argv[1:])
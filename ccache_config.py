@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Helpers for the ccache settings that are baked into the compile rules.
+#
+# When run directly, this compiles the same file from two different checkout directories with
+# separate local caches that share a file-backed remote store, and checks that the second compile
+# is a cache hit. This verifies that path normalization is working.
+
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+def version(ccache):
+    raw = (subprocess.check_output([ccache, '--version'])
+                     .decode('utf8')
+                     .split('\n', 1)[0]
+                     .split()[-1]
+                     .split('+')[0])
+    return [int(s) for s in raw.split('.') if s.isdigit()]
+
+def remote_storage_var(ccache_version):
+    if ccache_version >= [4, 4]:
+        return 'CCACHE_REMOTE_STORAGE'
+    if ccache_version >= [4, 2]:
+        # This was renamed to remote_storage in 4.4.
+        return 'CCACHE_SECONDARY_STORAGE'
+    return None
+
+def rule_env(ccache_version, basedir=None, remote_storage=None):
+    """Returns the VAR=value assignments to put in front of ccache in the compile rules."""
+    env = []
+    if basedir:
+        # Rewrites absolute paths under basedir to relative ones before hashing. Together with not
+        # hashing the cwd (which is included when compiling with -g), this lets checkouts in
+        # different directories share cache entries.
+        env += ['CCACHE_BASEDIR=' + shlex.quote(basedir), 'CCACHE_NOHASHDIR=1']
+    if remote_storage:
+        env += ['%s=%s' % (remote_storage_var(ccache_version), shlex.quote(remote_storage))]
+    return env
+
+def stats(ccache, env):
+    output = subprocess.check_output([ccache, '--print-stats'], env=env).decode('utf8')
+    return dict(line.split('\t', 1) for line in output.splitlines() if '\t' in line)
+
+def selftest(ccache, compiler):
+    ccache_version = version(ccache)
+    if not remote_storage_var(ccache_version):
+        print("ccache >= 4.2 is needed for remote storage")
+        return 1
+
+    tmp = tempfile.mkdtemp(prefix='ccache_selftest')
+    try:
+        remote = os.path.join(tmp, 'remote')
+        os.makedirs(remote)
+        results = []
+        for checkout in ('checkout_a', 'checkout_b'):
+            root = os.path.join(tmp, checkout)
+            os.makedirs(os.path.join(root, 'src'))
+            with open(os.path.join(root, 'src', 'test.h'), 'w') as f:
+                f.write('inline int answer() { return 42; }\n')
+            with open(os.path.join(root, 'src', 'test.cpp'), 'w') as f:
+                f.write('#include "test.h"\nint main() { return answer(); }\n')
+
+            env = dict(os.environ, CCACHE_DIR=os.path.join(tmp, checkout + '_cache'))
+            for assignment in rule_env(ccache_version, root, 'file:' + remote):
+                name, value = assignment.split('=', 1)
+                env[name] = shlex.split(value)[0]
+            # Use an absolute include path and debug info since those are what normally differ.
+            subprocess.check_call([ccache, compiler, '-g', '-I' + os.path.join(root, 'src'),
+                                   '-fdebug-prefix-map=%s=.' % root,
+                                   '-c', os.path.join('src', 'test.cpp'), '-o', 'test.o'],
+                                  cwd=root, env=env)
+            results.append(stats(ccache, env))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    hits = sum(int(results[1].get(name, 0)) for name in ('direct_cache_hit',
+                                                          'preprocessed_cache_hit'))
+    if not hits:
+        print("FAILED: compiling from a second checkout was a cache miss")
+        return 1
+    print("OK: compiling from a second checkout was a cache hit")
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(sys.argv[0] + ': ccache compiler')
+        sys.exit(1)
+    sys.exit(selftest(sys.argv[1], sys.argv[2]))
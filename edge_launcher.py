@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Runs a build command for build.ninja, optionally recording what it used and skipping rebuilds of
+# everything downstream when its output doesn't change.
+#
+#   edge_launcher.py [--log log_file] [--cutoff] [--cache dir --cache-size size] output
+#                    [VAR=value...] command args...
+#
+# --log appends what the command used to a log that build.py reads when it regenerates
+# build.ninja, to size the link and compile pools, and that build_report.py summarizes. The log is
+# a series of binary records, see ninja_log.RESOURCE_RECORD. Each is written with a single append
+# so that concurrent edges don't interleave.
+#
+# --cutoff removes the output before running the command and, if the new output has the same
+# contents as the old one, puts back the old mtime. With restat on the rule, ninja then skips the
+# edges that depend on it. The hash and mtime of the output are kept in output.hash so the old
+# output only needs to be hashed if something else changed it.
+#
+# It needs python >= 3.3, which build.py checks for before using it.
+#
+# --cache looks up the output in a local action cache, see action_cache.py, and only runs the
+# command when it isn't there. The output is removed before running the command either way, since
+# a restored output may be a hardlink to the cache.
+
+import os
+import struct
+import types
+import sys
+import time
+
+# Keep in sync with ninja_log.RESOURCE_RECORD, which this avoids importing to start faster.
+RECORD = struct.Struct('<dIIQQQiH')
+NO_USAGE = types.SimpleNamespace(ru_utime=0, ru_stime=0, ru_maxrss=0, ru_inblock=0, ru_oublock=0)
+
+def run(cmd):
+    """Returns the exit code and the resource usage of running cmd."""
+    env = None
+    while cmd and '=' in cmd[0] and not cmd[0].startswith('='):
+        # Leading assignments, like the ones in front of ccache.
+        name, value = cmd.pop(0).split('=', 1)
+        env = env if env is not None else dict(os.environ)
+        env[name] = value
+
+    env = env if env is not None else os.environ
+    if hasattr(os, 'posix_spawnp'): # Python >= 3.8
+        pid = os.posix_spawnp(cmd[0], cmd, env)
+    else:
+        pid = os.spawnvpe(os.P_NOWAIT, cmd[0], cmd, env)
+    # Unlike waitpid, this gets the resource usage, which includes the processes the command
+    # waited for, such as the linker run by the compiler driver.
+    _, status, rusage = os.wait4(pid, 0)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), rusage
+    return os.WEXITSTATUS(status), rusage
+
+def record(output, end, status, rusage):
+    name = output.encode('utf8')[:0xffff]
+    return RECORD.pack(end,
+                       int(rusage.ru_utime * 1000),
+                       int(rusage.ru_stime * 1000),
+                       rusage.ru_maxrss,
+                       rusage.ru_inblock * 512,
+                       rusage.ru_oublock * 512,
+                       status,
+                       len(name)) + name
+
+def file_hash(path):
+    import hashlib
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def old_output(output):
+    """Returns the mtime in ns and hash of the existing output, or None if there isn't one."""
+    try:
+        mtime = os.stat(output).st_mtime_ns
+    except OSError:
+        return None
+    try:
+        with open(output + '.hash') as f:
+            recorded_mtime, recorded_hash = f.read().split()
+        if int(recorded_mtime) == mtime:
+            return mtime, recorded_hash
+    except (IOError, ValueError):
+        pass
+    return mtime, file_hash(output)
+
+def cut_off(output, old):
+    """Restores the old mtime of output if its contents didn't change, and records its hash."""
+    new_hash = file_hash(output)
+    if old and old[1] == new_hash:
+        st = os.stat(output)
+        if st.st_nlink > 1:
+            # A hardlink to the action cache, whose entry would get the old mtime too.
+            import shutil
+            shutil.copyfile(output, output + '.tmp')
+            os.chmod(output + '.tmp', st.st_mode | 0o200)
+            os.replace(output + '.tmp', output)
+        os.utime(output, ns=(st.st_atime_ns, old[0]))
+    with open(output + '.hash', 'w') as f:
+        f.write('%d %s\n' % (os.stat(output).st_mtime_ns, new_hash))
+
+def main(argv):
+    args = argv[1:]
+    log_file = None
+    cutoff = False
+    cache_dir = None
+    cache_size = '20G'
+    while args and args[0].startswith('--'):
+        flag = args.pop(0)
+        if flag == '--log' and args:
+            log_file = args.pop(0)
+        elif flag == '--cutoff':
+            cutoff = True
+        elif flag == '--cache' and args:
+            cache_dir = args.pop(0)
+        elif flag == '--cache-size' and args:
+            cache_size = args.pop(0)
+        else:
+            args = []
+    if len(args) < 2:
+        print(argv[0] + ': [--log log_file] [--cutoff] [--cache dir --cache-size size] output'
+              ' [VAR=value...] command args...')
+        return 1
+
+    output, cmd = args[0], args[1:]
+    old = None
+    if cutoff:
+        old = old_output(output)
+        if old:
+            # Some tools, like ar, update an existing output rather than replacing it.
+            os.remove(output)
+
+    cache = None
+    hit = False
+    if cache_dir:
+        import action_cache
+        cache = action_cache.ActionCache(cache_dir, action_cache.parse_size(cache_size))
+        key, newest_input = cache.key(cmd, output)
+        hit = cache.restore(key, output, newest_input)
+
+    if hit:
+        status, rusage = 0, NO_USAGE
+    else:
+        try:
+            status, rusage = run(cmd)
+        except OSError as e:
+            print('%s: %s' % (cmd[0], e))
+            return 127
+        if cache and status == 0 and os.path.exists(output):
+            cache.store(key, output)
+
+    if cutoff and status == 0 and os.path.exists(output):
+        cut_off(output, old)
+
+    if log_file:
+        fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record(output, time.time(), status, rusage))
+        finally:
+            os.close(fd)
+    return status if status >= 0 else 128 - status
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
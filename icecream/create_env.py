@@ -0,0 +1,326 @@
+#! /usr/bin/env python3
+"""
+Builds an icecream compiler environment tarball.
+
+This is a parallel rewrite of icecc-create-env for linux. It produces the same tarball layout
+(and the same md5-based naming and symlink) as the shell script, but resolves the shared library
+closure with one ldd call per binary, copies and strips files in parallel, and compresses with
+pigz when it is installed.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+jobs = os.cpu_count() or 4
+
+def usage():
+    print("usage: %s --gcc <gcc_path> <g++_path>" % sys.argv[0])
+    print("usage: %s --clang <clang_path> <compiler_wrapper>" % sys.argv[0])
+    print("usage: Use --addfile <file> to add extra files.")
+    print("usage: Remaining argument (if present) is used as output path.")
+    sys.exit(1)
+
+def abs_path(path):
+    # Like `pwd -P`, this resolves symlinks in the directory but not the file itself.
+    if os.path.isdir(path):
+        return os.path.realpath(path)
+    return os.path.join(os.path.realpath(os.path.dirname(path) or '.'), os.path.basename(path))
+
+def output_of(*cmd):
+    return subprocess.check_output(cmd).decode('utf8').strip()
+
+def is_elf(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(4) == b'\x7fELF'
+    except (IOError, OSError):
+        return False
+
+ldd_line = re.compile(r'^[^/]*(/[^ ]*)')
+
+def ldd(path):
+    """Returns the full set of shared libraries that path needs.
+
+    ldd already reports the transitive closure, so there is no need to recurse into the libraries
+    it returns. Static binaries make ldd fail, so they just have no dependencies.
+    """
+    proc = subprocess.Popen(['ldd', path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    out = proc.communicate()[0].decode('utf8', 'replace')
+    if proc.returncode != 0:
+        return []
+    libs = []
+    for line in out.splitlines():
+        m = ldd_line.match(line)
+        if m and os.path.isfile(m.group(1)):
+            libs.append(m.group(1))
+    return libs
+
+class EnvFiles(object):
+    def __init__(self):
+        self.files = {} # name in the tarball -> path on this machine
+        self.covered = set() # paths whose libraries are already in self.files
+
+    def add(self, path, name=None):
+        if not name:
+            name = path
+        if not name:
+            return
+        name = re.sub(r'[^/]*/\.\./', '', name) # attempt to resolve foo/../bar
+        if name in self.files:
+            return
+        print("adding file %s" % (name if name == path else '%s=%s' % (name, path)))
+        self.files[name] = path
+
+    def add_libraries(self):
+        # Each round runs ldd over every binary we haven't looked at yet in parallel. Normally a
+        # single round finds everything, but preferring a library from a parent directory can pull
+        # in a file whose dependencies haven't been seen, so loop until nothing new shows up.
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            while True:
+                todo = sorted(set(path for path in self.files.values()
+                                  if path not in self.covered
+                                  and os.access(path, os.X_OK)
+                                  and is_elf(path)))
+                if not todo:
+                    return
+                self.covered.update(todo)
+                for libs in pool.map(ldd, todo):
+                    self.covered.update(libs)
+                    for lib in libs:
+                        # Check whether the same library also exists in the parent directory,
+                        # and prefer that on the assumption that it is a more generic one.
+                        baselib = re.sub(r'^(/[^/]*)/.*(/[^/]*)$', r'\1\2', lib)
+                        self.add(baselib if os.path.isfile(baselib) else lib)
+
+    def search_add(self, compiler, file_name, installdir=None):
+        path = output_of(compiler, '-print-prog-name=' + file_name)
+        if not path or path == file_name or not os.path.exists(path):
+            path = output_of(compiler, '-print-file-name=' + file_name)
+        if not os.path.exists(path):
+            return False
+
+        if not installdir:
+            # The file is going to be added to the tarball in the same path where the compiler
+            # found it. If that is relative to the compiler, make it relative to /usr instead
+            # since that is where the compiler will be in the tarball.
+            installdir = os.path.dirname(path)
+            abs_installdir = abs_path(installdir)
+            if installdir != abs_installdir:
+                compiler_basedir = abs_path(os.path.dirname(os.path.dirname(compiler)))
+                installdir = abs_installdir.replace(compiler_basedir, '/usr', 1)
+
+        self.add(path, os.path.join(installdir, file_name))
+        return True
+
+def add_prog(env, compiler, prog, dest):
+    path = output_of(compiler, '-print-prog-name=' + prog)
+    env.add('/usr/bin/' + prog if path == prog else path, dest)
+
+def make_ld_so_conf(clangprefix):
+    # For ldconfig -r to work, ld.so.conf must not contain relative paths in include
+    # directives. Make them absolute.
+    fd, tmp_ld_so_conf = tempfile.mkstemp(prefix='icecc_ld_so_conf')
+    with os.fdopen(fd, 'w') as out, open('/etc/ld.so.conf') as f:
+        for line in f:
+            # Mirror `while read directive path` so the output matches icecc-create-env exactly.
+            parts = line.split(None, 1) + ['', '']
+            directive, path = parts[0], parts[1].strip()
+            if directive == 'include' and not path.startswith('/'):
+                path = '/etc/' + path
+            out.write('%s %s\n' % (directive, path))
+
+        # Hack to make mongodbtoolchain clang work.
+        out.write('/opt/mongodbtoolchain/v2/lib\n')
+        out.write('/opt/mongodbtoolchain/v2/lib64\n')
+
+        # Work around new directory layout for clang in ubuntu >= 16.10
+        if clangprefix:
+            out.write(clangprefix + '/lib\n')
+    return tmp_ld_so_conf
+
+def install_file(tempdir, name, path):
+    dest = tempdir + name
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.copy2(path, dest)
+    if os.access(dest, os.X_OK):
+        subprocess.call(['strip', '-s', dest], stderr=subprocess.DEVNULL)
+    return name[1:]
+
+def md5_file(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def make_tarball(tempdir, target_files, tarball):
+    # pigz produces normal gzip output, so remotes can't tell the difference.
+    compressor = shutil.which('pigz')
+    compress_flags = ['--use-compress-program=pigz'] if compressor else ['-z']
+    with tempfile.NamedTemporaryFile('w', suffix='.list') as file_list:
+        file_list.write('\n'.join(target_files) + '\n')
+        file_list.flush()
+        subprocess.check_call(['tar', '-ch', '--numeric-owner'] + compress_flags
+                              + ['-f', tarball + '.tmp', '-C', tempdir, '-T', file_list.name])
+    os.rename(tarball + '.tmp', tarball)
+
+def main(args):
+    if args and args[0] == '--respect-path':
+        args = args[1:] # backward compat
+
+    gcc = gxx = clang = wrapper = None
+    if len(args) >= 3 and args[0] == '--gcc':
+        gcc, gxx = args[1:3]
+        args = args[3:]
+    elif len(args) >= 3 and args[0] == '--clang':
+        clang, wrapper = args[1:3]
+        args = args[3:]
+    elif len(args) >= 2 and not args[0].startswith('--'):
+        gcc, gxx = args[:2] # backward compat
+        args = args[2:]
+    else:
+        usage()
+
+    if sys.platform == 'darwin':
+        print("darwin is not supported, use icecc-create-env instead.")
+        return 1
+
+    for exe in (gcc, gxx, clang, wrapper):
+        if exe and not os.access(exe, os.X_OK):
+            print("'%s' is no executable." % exe)
+            return 1
+    for exe in (gcc, gxx, clang):
+        if exe and not is_elf(exe):
+            print("%s is not a binary file." % exe)
+            return 1
+
+    extrafiles = []
+    while len(args) >= 2 and args[0] == '--addfile':
+        extrafiles.append(args[1])
+        args = args[2:]
+    out_file = args[0] if args else None
+
+    env = EnvFiles()
+
+    # for testing the environment is usable at all
+    if os.access('/bin/true', os.X_OK):
+        env.add('/bin/true')
+    elif os.access('/usr/bin/true', os.X_OK):
+        env.add('/usr/bin/true', '/bin/true')
+
+    clangprefix = None
+    if gcc:
+        gcc = abs_path(gcc)
+        gxx = abs_path(gxx)
+        env.add(gcc, '/usr/bin/gcc')
+        env.add(gxx, '/usr/bin/g++')
+        env.add(output_of(gcc, '-print-prog-name=cc1'), '/usr/bin/cc1')
+        env.add(output_of(gxx, '-print-prog-name=cc1plus'), '/usr/bin/cc1plus')
+        add_prog(env, gcc, 'as', '/usr/bin/as')
+        add_prog(env, gcc, 'objcopy', '/usr/bin/objcopy')
+        env.search_add(gcc, 'specs')
+        env.search_add(gcc, 'liblto_plugin.so')
+
+    if clang:
+        env.add(clang, '/usr/bin/clang')
+        # HACK: Older icecream remotes have /usr/bin/{gcc|g++} hardcoded and wouldn't
+        # call /usr/bin/clang at all. So include a wrapper binary that will call gcc or clang
+        # depending on an extra argument added by icecream.
+        env.add(wrapper, '/usr/bin/gcc')
+        env.add(wrapper, '/usr/bin/g++')
+        env.add(output_of(clang, '-print-prog-name=as'), '/usr/bin/as')
+        env.add(output_of(clang, '-print-prog-name=objcopy'), '/usr/bin/objcopy')
+
+        # clang always uses its internal .h files
+        clangincludes = os.path.dirname(output_of(clang, '-print-file-name=include/limits.h'))
+        clangprefix = os.path.dirname(os.path.dirname(abs_path(clang)))
+        for root, dirs, files in os.walk(clangincludes):
+            for f in sorted(files):
+                path = os.path.join(root, f)
+                # and convert from <prefix> to /usr if needed
+                env.add(path, abs_path(path).replace(clangprefix, '/usr', 1))
+
+    for extrafile in extrafiles:
+        env.add(extrafile)
+
+    tmp_ld_so_conf = None
+    if os.path.isfile('/etc/ld.so.conf'):
+        tmp_ld_so_conf = make_ld_so_conf(clangprefix)
+        env.add(tmp_ld_so_conf, '/etc/ld.so.conf')
+
+    conf_d = '/etc/ld.so.conf.d'
+    for name in sorted(os.listdir(conf_d)) if os.path.isdir(conf_d) else []:
+        if not name.endswith('.conf'):
+            continue
+        path = os.path.join(conf_d, name)
+        if os.path.exists(path):
+            env.add(path)
+        else:
+            # This can happen with a dangling symlink
+            print("skipping non-existent file %s" % path)
+
+    env.add_libraries()
+
+    tempdir = tempfile.mkdtemp(prefix='iceccenv')
+    try:
+        # special case for weird multilib setups
+        for d in ('/lib', '/lib64', '/usr/lib', '/usr/lib64'):
+            if os.path.islink(d) and not os.path.isdir(d):
+                os.makedirs(os.path.dirname(tempdir + d), exist_ok=True)
+                shutil.copy2(d, tempdir + d)
+
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            target_files = list(pool.map(lambda item: install_file(tempdir, *item),
+                                         sorted(env.files.items())))
+
+        os.makedirs(os.path.join(tempdir, 'proc'))
+        open(os.path.join(tempdir, 'proc', 'cpuinfo'), 'w').close()
+        target_files.append('proc/cpuinfo')
+
+        if os.access('/sbin/ldconfig', os.X_OK):
+            os.makedirs(os.path.join(tempdir, 'var', 'cache', 'ldconfig'))
+            subprocess.check_call(['/sbin/ldconfig', '-r', tempdir])
+            target_files.append('etc/ld.so.cache')
+
+        # Sort the files in order to make the md5sums independent of ordering. This must match
+        # icecc-create-env so that identical environments get identical names.
+        target_files.sort()
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            sums = pool.map(md5_file, [os.path.join(tempdir, f) for f in target_files])
+            md5 = hashlib.md5(''.join(s + '\n' for s in sums).encode('ascii')).hexdigest()
+
+        if out_file:
+            md5 = os.path.join(os.path.dirname(out_file), md5)
+
+        print("creating %s.tar.gz" % md5)
+        try:
+            make_tarball(tempdir, target_files, os.path.abspath(md5 + '.tar.gz'))
+        except subprocess.CalledProcessError:
+            print("Couldn't create archive")
+            return 3
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+        if tmp_ld_so_conf:
+            os.remove(tmp_ld_so_conf)
+
+    if out_file:
+        print("linking %s to %s.tar.gz" % (out_file, md5))
+        if os.path.lexists(out_file):
+            os.remove(out_file)
+        os.symlink(os.path.basename(md5 + '.tar.gz'), out_file)
+
+    # Print the tarball name to fd 5 (if it's open, created by whatever has invoked this)
+    try:
+        os.write(5, ('%s.tar.gz\n' % md5).encode('utf8'))
+    except OSError:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
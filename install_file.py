@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Installs a file for build.ninja's INSTALL rule with --ninja-install=link, without copying its
+# data where possible:
+#
+#   install_file.py source dest
+#
+# dest becomes a reflink of source where the filesystem supports them (btrfs, xfs), otherwise a
+# hardlink to it, and only a copy if they are on different filesystems. Either way dest ends up
+# with the mtime of source, so an unchanged dest is left alone and the rule can use restat.
+
+import errno
+import fcntl
+import os
+import shutil
+import sys
+
+FICLONE = 0x40049409 # From linux/fs.h.
+
+def clone(src, dst):
+    """Copies src to dst as a reflink, returning False if the filesystem doesn't support it."""
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY):
+                raise
+    os.remove(dst)
+    return False
+
+def install(source, dest):
+    st = os.stat(source)
+    try:
+        dest_st = os.stat(dest)
+        if os.path.samestat(st, dest_st) or (
+                (dest_st.st_mtime_ns, dest_st.st_size) == (st.st_mtime_ns, st.st_size)):
+            return # Already installed, by this or a previous clone.
+    except OSError:
+        pass
+
+    tmp = '%s.%d.tmp' % (dest, os.getpid())
+    if clone(source, tmp):
+        shutil.copymode(source, tmp)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    else:
+        try:
+            os.link(source, tmp)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copy2(source, tmp)
+    os.replace(tmp, dest)
+
+def main(argv):
+    if len(argv) != 3:
+        print(argv[0] + ': source dest')
+        return 1
+    install(argv[1], argv[2])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
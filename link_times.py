@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Summarizes how long the LINK, SHLINK and AR edges took in the last build, and compares that to
+# a saved baseline. This is meant for checking the effect of --ninja-fast-link:
+#
+#   link_times.py save builddir before.json     # after a build without --ninja-fast-link
+#   link_times.py compare builddir before.json  # after the same build with it
+#
+# The rule for each output comes from the .ninja_edges.json file that build.py writes next to
+# .ninja_log.
+
+import collections
+import json
+import os
+import sys
+
+import ninja_log
+
+LINK_RULES = ('LINK', 'SHLINK', 'AR')
+
+def link_durations(builddir):
+    """Returns a dict from each output linked in the last build to its rule and duration in ms."""
+    edges = ninja_log.read_edges(os.path.join(builddir, '.ninja_edges.json'))
+    durations = {}
+    for entry in ninja_log.read_log(os.path.join(builddir, '.ninja_log')):
+        edge = edges.get(entry.output)
+        if edge and edge.rule in LINK_RULES:
+            durations[entry.output] = (edge.rule, entry.end - entry.start)
+    return durations
+
+def totals(durations):
+    by_rule = collections.defaultdict(lambda: [0, 0])
+    for rule, duration in durations.values():
+        by_rule[rule][0] += 1
+        by_rule[rule][1] += duration
+    return by_rule
+
+def show(durations, top=10):
+    print('%-8s %8s %12s %10s' % ('rule', 'edges', 'total (s)', 'mean (s)'))
+    for rule, (count, total) in sorted(totals(durations).items()):
+        print('%-8s %8d %12.1f %10.2f' % (rule, count, total / 1000.0, total / 1000.0 / count))
+    print()
+    print('Slowest:')
+    for output, (rule, duration) in sorted(durations.items(), key=lambda i: -i[1][1])[:top]:
+        print('%8.1fs  %-8s %s' % (duration / 1000.0, rule, output))
+
+def compare(before, after, top=10):
+    before_totals = totals(before)
+    after_totals = totals(after)
+    print('%-8s %14s %14s %8s' % ('rule', 'before (s)', 'after (s)', 'change'))
+    for rule in sorted(set(before_totals) | set(after_totals)):
+        old = before_totals[rule][1] / 1000.0
+        new = after_totals[rule][1] / 1000.0
+        print('%-8s %14.1f %14.1f %7.0f%%' % (rule, old, new,
+                                              (new - old) / old * 100 if old else 0))
+
+    # Only outputs that were linked both times are comparable one to one.
+    common = [(output, before[output][1], after[output][1])
+              for output in set(before) & set(after)]
+    if common:
+        print()
+        print('Slowest before, in both builds:')
+        for output, old, new in sorted(common, key=lambda c: -c[1])[:top]:
+            print('%8.1fs -> %6.1fs  %s' % (old / 1000.0, new / 1000.0, output))
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ('show', 'save', 'compare') or (
+            len(argv) != (3 if argv[1] == 'show' else 4)):
+        print(argv[0] + ': show builddir')
+        print(argv[0] + ': save builddir baseline.json')
+        print(argv[0] + ': compare builddir baseline.json')
+        return 1
+
+    if not os.path.exists(os.path.join(argv[2], '.ninja_edges.json')):
+        # Written by build.py, but only with --ninja-fast-link or --ninja-cache-report before.
+        print('No .ninja_edges.json in %s. Regenerate build.ninja to write it'
+              % argv[2])
+        return 1
+    durations = link_durations(argv[2])
+    if argv[1] == 'show':
+        show(durations)
+    elif argv[1] == 'save':
+        with open(argv[3], 'w') as f:
+            json.dump(durations, f, indent=0, sort_keys=True)
+        show(durations)
+    else:
+        with open(argv[3]) as f:
+            before = dict((output, tuple(value)) for output, value in json.load(f).items())
+        compare(before, durations)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
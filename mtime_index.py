@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Avoids rebuilding everything after switching branches and back. Checking out a branch gives every
+# file that differs a new mtime, so ninja rebuilds everything that depends on them even when they
+# are back to the contents they had when you last built.
+#
+#   mtime_index.py save builddir           Records the mtimes of the sources and build outputs
+#   mtime_index.py restore builddir        Puts back the recorded mtimes of sources that have the
+#                                          same contents as when they were recorded
+#   mtime_index.py checkout builddir args  Runs save, git checkout args, then restore
+#
+# Run it from the top of the mongo repo. Snapshots are kept in .ninja_mtime_index.json in ninja's
+# builddir, keyed by the git tree that was checked out, for the last MAX_SNAPSHOTS trees.
+#
+# Giving a source back an older mtime is only safe if everything built from it is also what was
+# built from it then. Outputs that were built or rebuilt since the snapshot are removed so that
+# ninja builds them again, and if a .ninja file was regenerated since, nothing is restored since
+# ninja would not know to regenerate it.
+
+import json
+import os
+import stat
+import subprocess
+import sys
+import time
+
+import ninja_log
+
+MAX_SNAPSHOTS = 8
+
+def git(*args):
+    return subprocess.check_output(('git',) + args).decode('utf8')
+
+def clean_sources():
+    """Returns a dict from each tracked file that matches the git index to its blob hash."""
+    blobs = {}
+    for line in git('ls-files', '-s', '-z').split('\0'):
+        if not line:
+            continue
+        info, path = line.split('\t', 1)
+        mode, blob, stage = info.split()
+        if stage == '0' and not mode.startswith('16'): # Skip conflicts and submodules.
+            blobs[path] = blob
+    for path in git('diff', '--name-only', '-z').split('\0'):
+        blobs.pop(path, None)
+    return blobs
+
+def current_tree():
+    return git('rev-parse', 'HEAD^{tree}').strip()
+
+def outputs(builddir):
+    log = os.path.join(builddir, '.ninja_log')
+    if not os.path.exists(log):
+        return []
+    return [entry.output for entry in ninja_log.read_log(log, last_build_only=False)]
+
+def read_index(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_index(path, index):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+
+def index_path(builddir):
+    return os.path.join(builddir, '.ninja_mtime_index.json')
+
+def save(builddir):
+    sources = {}
+    for path, blob in clean_sources().items():
+        try:
+            sources[path] = [blob, os.stat(path).st_mtime_ns]
+        except OSError:
+            pass
+    built = {}
+    for path in outputs(builddir):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        # Directories made by Mkdir get a new mtime whenever anything is built in them, so they
+        # would always look rebuilt, and removing one would remove everything in it.
+        if stat.S_ISDIR(st.st_mode):
+            continue
+        built[path] = [st.st_mtime_ns, st.st_size]
+
+    index = read_index(index_path(builddir))
+    index[current_tree()] = dict(saved=time.time(), sources=sources, outputs=built)
+    for tree in sorted(index, key=lambda t: index[t]['saved'])[:-MAX_SNAPSHOTS]:
+        del index[tree]
+    write_index(index_path(builddir), index)
+    print('Saved mtimes of %d sources and %d outputs' % (len(sources), len(built)))
+
+def restore(builddir):
+    snapshot = read_index(index_path(builddir)).get(current_tree())
+    if not snapshot:
+        print('No saved mtimes for this checkout')
+        return 0
+
+    # Outputs first built since the snapshot count too, since they may have been built from
+    # sources that are about to get back mtimes older than them.
+    changed = []
+    for path in set(outputs(builddir)):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            continue
+        if [st.st_mtime_ns, st.st_size] != snapshot['outputs'].get(path):
+            changed.append(path)
+    regenerated = [path for path in changed if path.endswith('.ninja')]
+    if regenerated:
+        print('Not restoring mtimes since these were regenerated: ' + ' '.join(regenerated))
+        return 0
+
+    # Ninja builds these again because they are missing, whatever their inputs' mtimes are.
+    for path in changed:
+        os.remove(path)
+
+    restored = 0
+    for path, blob in clean_sources().items():
+        recorded = snapshot['sources'].get(path)
+        if not recorded or recorded[0] != blob:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if st.st_mtime_ns != recorded[1]:
+            os.utime(path, ns=(st.st_atime_ns, recorded[1]))
+            restored += 1
+    print('Restored mtimes of %d sources, removed %d outputs built since' % (
+        restored, len(changed)))
+    return 0
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ('save', 'restore', 'checkout') or (
+            argv[1] != 'checkout' and len(argv) != 3):
+        print(argv[0] + ': save builddir')
+        print(argv[0] + ': restore builddir')
+        print(argv[0] + ': checkout builddir git_checkout_args...')
+        return 1
+
+    builddir = argv[2]
+    if argv[1] == 'save':
+        save(builddir)
+        return 0
+    if argv[1] == 'restore':
+        return restore(builddir)
+
+    save(builddir)
+    status = subprocess.call(['git', 'checkout'] + argv[3:])
+    if status:
+        return status
+    return restore(builddir)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# Runs the small helper scripts used by build.ninja in a long-lived server to avoid paying for
+# python startup and imports on every edge.
+#
+#   ninja_helper.py socket script args...   Runs script's main() in the server, starting one if
+#                                           needed. Falls back to running it in this process.
+#   ninja_helper.py --serve socket          Runs the server. It exits when idle or when any of
+#                                           the scripts change.
+#
+# The client only uses the standard library so it can be run with -S. It avoids importing modules
+# that aren't already loaded at startup, such as json and socket, which would take longer than
+# the rest of the client.
+#
+# A request is the cwd, script and args separated by NULs, ended by closing the socket for
+# writing. The reply is the exit status, or - if the client should run the script itself, on the
+# first line, followed by the script's output.
+
+import _socket
+import os
+import sys
+import time
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = ('subst_file', 'test_list', 'touch_compiler_timestamps', 'split_lines', 'install_file')
+IDLE_TIMEOUT = 10 * 60
+CONNECT_TIMEOUT = 2
+
+def script_name(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name not in SCRIPTS:
+        raise ValueError('%s cannot be run by the ninja helper' % path)
+    return name
+
+def run_in_process(script, args):
+    sys.path.insert(0, my_dir)
+    module = __import__(script_name(script))
+    return module.main([script] + args)
+
+def connect(socket_path):
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def spawn_server(socket_path):
+    import subprocess
+    # The server must not inherit ninja's pipe for this edge's output, or ninja would wait for
+    # the server to exit before finishing the edge.
+    with open(os.devnull) as devnull, open(socket_path + '.log', 'a') as log:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', socket_path],
+                         stdin=devnull, stdout=log, stderr=log, close_fds=True,
+                         start_new_session=True)
+
+def request(socket_path, script, args):
+    """Returns the reply from the server, or None if it couldn't run the script."""
+    sock = connect(socket_path)
+    if not sock:
+        spawn_server(socket_path)
+        deadline = time.time() + CONNECT_TIMEOUT
+        while not sock and time.time() < deadline:
+            time.sleep(0.01)
+            sock = connect(socket_path)
+        if not sock:
+            return None
+
+    try:
+        sock.sendall('\0'.join([os.getcwd(), script] + args).encode('utf8'))
+        sock.shutdown(_socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+
+    status, _, output = b''.join(chunks).decode('utf8').partition('\n')
+    if not status or status == '-':
+        return None # The server went away or wants to restart.
+    return int(status), output
+
+def client(socket_path, script, args):
+    reply = request(socket_path, script, args)
+    if reply is None:
+        return run_in_process(script, args)
+    status, output = reply
+    sys.stdout.write(output)
+    return status
+
+class ThreadOutput(object):
+    """Sends what each request's thread prints back to its client."""
+    def __init__(self, real, local):
+        self.real = real
+        self.local = local
+
+    def write(self, text):
+        (getattr(self.local, 'buffer', None) or self.real).write(text)
+
+    def flush(self):
+        (getattr(self.local, 'buffer', None) or self.real).flush()
+
+def serve(socket_path):
+    import fcntl
+    import io
+    import socketserver
+    import threading
+    import traceback
+
+    # Only one server per socket. Others that were spawned at the same time just exit.
+    lock = open(socket_path + '.lock', 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        return 0
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    sys.path.insert(0, my_dir)
+    modules = dict((name, __import__(name)) for name in SCRIPTS)
+    watched = [os.path.abspath(__file__)] + [m.__file__ for m in modules.values()]
+    mtimes = [os.stat(path).st_mtime for path in watched]
+    cwd = os.getcwd()
+    output = sys.stdout = ThreadOutput(sys.stdout, threading.local())
+    state = dict(last_request=time.time(), stopping=False)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            state['last_request'] = time.time()
+            request = self.rfile.read().decode('utf8').split('\0')
+            request_cwd, script, args = request[0], request[1], request[2:]
+            if (state['stopping'] or request_cwd != cwd
+                    or [os.stat(path).st_mtime for path in watched] != mtimes):
+                # Let the client run it and stop so that the next request starts a new server.
+                if request_cwd == cwd:
+                    stop()
+                self.wfile.write(b'-\n')
+                return
+
+            buffer = output.local.buffer = io.StringIO()
+            try:
+                status = modules[script_name(script)].main([script] + args)
+            except SystemExit as e:
+                status = e.code
+            except Exception:
+                buffer.write(traceback.format_exc())
+                status = 1
+            finally:
+                output.local.buffer = None
+            self.wfile.write(('%d\n%s' % (status or 0, buffer.getvalue())).encode('utf8'))
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    server = Server(socket_path, Handler)
+
+    def stop():
+        if not state['stopping']:
+            state['stopping'] = True
+            # A new server can start as soon as the socket and lock are gone, while this one
+            # finishes the requests it has already accepted.
+            os.unlink(socket_path)
+            lock.close()
+            threading.Thread(target=server.shutdown).start()
+
+    def watch_idle():
+        while not state['stopping']:
+            time.sleep(1)
+            if time.time() - state['last_request'] > IDLE_TIMEOUT:
+                stop()
+
+    threading.Thread(target=watch_idle, daemon=True).start()
+    server.serve_forever()
+    server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--serve':
+        sys.exit(serve(sys.argv[2]))
+
+    if len(sys.argv) < 3:
+        print(sys.argv[0] + ': socket script args...')
+        print(sys.argv[0] + ': --serve socket')
+        sys.exit(1)
+    sys.exit(client(sys.argv[1], sys.argv[2], sys.argv[3:]))
@@ -0,0 +1,140 @@
+# Readers for ninja's .ninja_log, the edge map that build.py writes next to it and the resource log
+# that edge_launcher.py writes.
+
+import collections
+import json
+import os
+import struct
+
+LogEntry = collections.namedtuple('LogEntry', 'start end mtime output cmdhash')
+
+def read_log(path, last_build_only=True):
+    """Returns the LogEntries from a .ninja_log, keeping the last entry for each output.
+
+    Ninja appends an entry whenever an edge finishes, so end times only go backwards at the start
+    of a new build. With last_build_only, only entries from the most recent build are returned.
+    """
+    entries = collections.OrderedDict()
+    last_end = None
+    with open(path) as f:
+        header = f.readline()
+        if not header.startswith('# ninja log v'):
+            raise ValueError('%s is not a ninja log' % path)
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 5:
+                continue
+            entry = LogEntry(int(fields[0]), int(fields[1]), int(fields[2]), fields[3], fields[4])
+            if last_build_only and last_end is not None and entry.end < last_end:
+                entries.clear()
+            last_end = entry.end
+            entries.pop(entry.output, None)
+            entries[entry.output] = entry
+    return list(entries.values())
+
+def write_edges(path, builds):
+    """Saves the rule, outputs and inputs of every build for the reporting tools."""
+    def paths(value):
+        if value is None:
+            return []
+        return [value] if isinstance(value, str) else list(value)
+
+    edges = []
+    for build in builds:
+        edges.append([build['rule'],
+                      paths(build.get('outputs')) + paths(build.get('implicit_outputs')),
+                      paths(build.get('inputs')),
+                      paths(build.get('implicit')) + paths(build.get('order_only'))])
+
+    content = json.dumps(edges, separators=(',', ':'))
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return
+    with open(path + '.tmp', 'w') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+
+Edge = collections.namedtuple('Edge', 'rule outputs inputs deps')
+
+def read_edges(path):
+    """Returns a dict from each output to its Edge."""
+    by_output = {}
+    with open(path) as f:
+        for rule, outputs, inputs, deps in json.load(f):
+            edge = Edge(rule, outputs, inputs, deps)
+            for output in outputs:
+                by_output[output] = edge
+    return by_output
+
+# The records that edge_launcher.py appends: the end time, user and system cpu time in ms, peak
+# RSS in KiB, bytes read and written, exit status (negative for a signal) and the length of the
+# output's name, which follows.
+RESOURCE_RECORD = struct.Struct('<dIIQQQiH')
+
+Resources = collections.namedtuple(
+        'Resources', 'output end user_ms sys_ms max_rss read_bytes write_bytes status')
+
+def read_resources(path):
+    """Yields the Resources for every edge in an edge launcher log, oldest first."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + RESOURCE_RECORD.size <= len(data):
+        fields = RESOURCE_RECORD.unpack_from(data, offset)
+        offset += RESOURCE_RECORD.size
+        name = data[offset:offset + fields[-1]]
+        offset += fields[-1]
+        if len(name) != fields[-1]:
+            break # A partial record from an interrupted build.
+        yield Resources(name.decode('utf8', 'replace'), *fields[:-1])
+
+def read_rss(path):
+    """Returns a dict from each output in an edge launcher log to its largest peak RSS in KiB.
+
+    The largest is kept rather than the last since a ccache hit needs much less than the compile.
+    """
+    rss = {}
+    for entry in read_resources(path):
+        rss[entry.output] = max(entry.max_rss, rss.get(entry.output, 0))
+    return rss
+
+def read_deps(path):
+    """Returns a dict from each output in a .ninja_deps file to the list of its deps.
+
+    Supports versions 3 and 4 of the format, which only differ in the size of the mtimes.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    header = b'# ninjadeps\n'
+    if not data.startswith(header):
+        raise ValueError('%s is not a ninja deps log' % path)
+    version, = struct.unpack_from('<i', data, len(header))
+    if version not in (3, 4):
+        raise ValueError('%s has unsupported version %d' % (path, version))
+    mtime_size = 4 if version == 3 else 8
+
+    paths = []
+    deps = {}
+    offset = len(header) + 4
+    while offset + 4 <= len(data):
+        size, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        is_deps = size & 0x80000000
+        size &= 0x7fffffff
+        if offset + size > len(data):
+            break # A partial record from an interrupted build.
+        if is_deps:
+            out, = struct.unpack_from('<i', data, offset)
+            inputs_offset = offset + 4 + mtime_size
+            ids = struct.unpack_from('<%di' % ((offset + size - inputs_offset) // 4),
+                                     data, inputs_offset)
+            # Later records for an output replace earlier ones.
+            deps[out] = ids
+        else:
+            # The path is padded with NULs to a multiple of 4 and followed by a checksum.
+            paths.append(data[offset:offset + size - 4].rstrip(b'\0').decode('utf8', 'replace'))
+        offset += size
+
+    return dict((paths[out], [paths[i] for i in ids if i < len(paths)])
+                for out, ids in deps.items() if out < len(paths))
@@ -3,12 +3,17 @@
 import shlex
 import sys
 
-if len(sys.argv) != 2:
-    print(sys.argv[0] + ': rsp_file')
-    sys.exit(1)
+def main(argv):
+    if len(argv) != 2:
+        print(argv[0] + ': rsp_file')
+        return 1
 
-with open(sys.argv[1]) as f:
-    lines = [arg + '\n' for arg in shlex.split(f.read(), posix=False)]
+    with open(argv[1]) as f:
+        lines = [arg + '\n' for arg in shlex.split(f.read(), posix=False)]
 
-with open(sys.argv[1], 'w') as f:
-    f.writelines(lines)
+    with open(argv[1], 'w') as f:
+        f.writelines(lines)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
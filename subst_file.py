@@ -6,33 +6,183 @@ import sys
 import re
 import json
 
-if len(sys.argv) != 4:
-    print(sys.argv[0] + ': in out json_subs')
-    sys.exit(1)
-
-with open(sys.argv[1]) as f:
-    contents = f.read()
-out_file_name = sys.argv[2]
-with open(sys.argv[3]) as f:
-    vars = json.load(f)
-    subs = vars['subs']
-    do_chmod = vars['do_chmod']
-
-if isinstance(subs, dict):
-    subs = subs.items()
-
-for k,v in subs:
-    # scons Substfile just defers to re.sub
-    contents = re.sub(k, str(v), contents)
-
-# Don't write to the file if it isn't changing
-if os.path.exists(out_file_name) and not do_chmod:
-    with open(out_file_name) as f:
-        if f.read() == contents:
-            sys.exit(0)
-
-with open(out_file_name, 'w') as f:
-    f.write(contents)
-
-if do_chmod:
-    subprocess.check_call(['chmod', 'oug+x', out_file_name])
+compiled_patterns = {}
+combined_patterns = {}
+single_pass_tables = {}
+
+# Below this, replacing each key in turn is about as fast since re searches for each literal key
+# with a fast scan, while the single pass has to call back into python for each match.
+SINGLE_PASS_MIN_KEYS = 12
+
+REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+
+def combined_pattern(keys):
+    """Returns a pattern matching any of the keys and a KeyInfo, if the keys can be replaced in
+    one pass.
+
+    That requires the keys to be literal, and no key to be part of another.
+    """
+    keys = tuple(keys)
+    if keys in combined_patterns:
+        return combined_patterns[keys]
+
+    if len(keys) < SINGLE_PASS_MIN_KEYS:
+        combined_patterns[keys] = None, None
+        return None, None
+
+    literal = not any(REGEX_SPECIAL_CHARS.intersection(k) for k in keys)
+    nested = any(i != j and (not a or a in b)
+                 for i, a in enumerate(keys) for j, b in enumerate(keys))
+
+    combined = None, None
+    if literal and not nested:
+        # Factoring out the common prefix lets re search for it like a single literal key.
+        prefix = os.path.commonprefix(keys)
+        combined = (re.compile(re.escape(prefix) +
+                               '(?:%s)' % '|'.join(re.escape(k[len(prefix):]) for k in keys)),
+                    KeyInfo(keys))
+    combined_patterns[keys] = combined
+    return combined
+
+class KeyInfo(object):
+    def __init__(self, keys):
+        # Keys like @A@ and @B@ can overlap in the text (@A@B@). That is rare enough to only
+        # check for where it is possible, at these offsets into a match of each key.
+        self.offsets = dict((k, [o for o in range(1, len(k))
+                                 if any(other.startswith(k[o:]) for other in keys)])
+                            for k in keys)
+
+        self.max_key_len = max(len(k) for k in keys)
+
+        # For each key, the keys after it joined together, and their proper prefixes and
+        # suffixes. This is what a value replacing that key must not overlap.
+        self.later = []
+        for i in range(len(keys)):
+            later = keys[i + 1:]
+            self.later.append(('\0'.join(later),
+                               set(k[:n] for k in later for n in range(1, len(k))),
+                               set(k[-n:] for k in later for n in range(1, len(k)))))
+
+    def overlaps_later_key(self, i, value, pattern):
+        joined, prefixes, suffixes = self.later[i]
+        if not joined:
+            return False
+        if not value or value in joined or pattern.search(value):
+            return True
+        return any(value[-n:] in prefixes or value[:n] in suffixes
+                   for n in range(1, min(len(value), self.max_key_len)))
+
+def single_pass_table(subs, pattern, info):
+    """Returns a dict from each key to its replacement if no key can match text that overlaps
+    the value that replaced an earlier key.
+    """
+    table = {}
+    for i, (k, v) in enumerate(subs):
+        # This is what each match of a literal key is replaced with.
+        value = v
+        if '\\' in v:
+            try:
+                value = re.sub(re.escape(k), v, k)
+            except re.error:
+                return None
+        if info.overlaps_later_key(i, value, pattern):
+            return None
+        table[k] = value
+    return table
+
+class KeysOverlap(Exception):
+    pass
+
+def substitute_single_pass(contents, pattern, info, table):
+    def replace(m):
+        key = m.group(0)
+        # A key starting inside this match would have been replaced first by the sequential
+        # substitution if it comes first.
+        for offset in info.offsets[key]:
+            if pattern.match(contents, m.start() + offset):
+                raise KeysOverlap()
+        return table[key]
+
+    try:
+        return pattern.sub(replace, contents)
+    except KeysOverlap:
+        return None
+
+def substitute(contents, subs):
+    if isinstance(subs, dict):
+        subs = subs.items()
+    subs = [(k, str(v)) for k, v in subs]
+
+    pattern, info = combined_pattern(k for k, v in subs)
+    if pattern:
+        # Many files in a batch use the same substitutions.
+        subs_tuple = tuple(subs)
+        if subs_tuple not in single_pass_tables:
+            single_pass_tables[subs_tuple] = single_pass_table(subs, pattern, info)
+        table = single_pass_tables[subs_tuple]
+        result = table and substitute_single_pass(contents, pattern, info, table)
+        if result is not None:
+            return result
+
+    for k,v in subs:
+        # scons Substfile just defers to re.sub. Compiling each key once lets batches that share
+        # keys skip re's own cache lookup.
+        pattern = compiled_patterns.get(k)
+        if pattern is None:
+            pattern = compiled_patterns[k] = re.compile(k)
+        contents = pattern.sub(v, contents)
+    return contents
+
+def subst_file(in_file_name, out_file_name, subs, do_chmod):
+    with open(in_file_name) as f:
+        write_file(out_file_name, substitute(f.read(), subs), do_chmod)
+
+def write_file(out_file_name, contents, do_chmod, force=False):
+    # Don't write to the file if it isn't changing, unless it needs to be newer than its inputs.
+    if not do_chmod and not force:
+        try:
+            with open(out_file_name) as f:
+                if f.read() == contents:
+                    return
+        except IOError:
+            pass
+
+    with open(out_file_name, 'w') as f:
+        f.write(contents)
+
+    if do_chmod:
+        subprocess.check_call(['chmod', 'oug+x', out_file_name])
+
+def run_job(job):
+    # Jobs with contents rather than an input file come from Textfile, which build.py already
+    # substituted.
+    if 'contents' in job:
+        write_file(job['out'], job['contents'], job['do_chmod'], job.get('force', False))
+    else:
+        subst_file(job['in'], job['out'], job['subs'], job['do_chmod'])
+
+def main(argv):
+    if len(argv) == 3 and argv[1] == '--batch':
+        # Handles many files in one process. The json is a list of objects with in or contents,
+        # out, subs and do_chmod keys.
+        with open(argv[2]) as f:
+            for job in json.load(f):
+                run_job(job)
+        return 0
+
+    if len(argv) not in (3, 4):
+        print(argv[0] + ': in out json_subs')
+        print(argv[0] + ': out json_contents')
+        print(argv[0] + ': --batch json_jobs')
+        return 1
+
+    with open(argv[-1]) as f:
+        job = json.load(f)
+    job['out'] = argv[-2]
+    if len(argv) == 4:
+        job['in'] = argv[1]
+    run_job(job)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -4,21 +4,26 @@ import os
 import sys
 import json
 
-if len(sys.argv) != 3:
-    print(sys.argv[0] + ': out json_list')
-    sys.exit(1)
+def main(argv):
+    if len(argv) != 3:
+        print(argv[0] + ': out json_list')
+        return 1
 
-out_file_name = sys.argv[1]
-with open(sys.argv[2]) as f:
-    list = json.load(f)
+    out_file_name = argv[1]
+    with open(argv[2]) as f:
+        list = json.load(f)
 
-contents = '\n'.join(list) + '\n'
+    contents = '\n'.join(list) + '\n'
 
-# Don't write to the file if it isn't changing
-if os.path.exists(out_file_name):
-    with open(out_file_name) as f:
-        if f.read() == contents:
-            sys.exit(0)
+    # Don't write to the file if it isn't changing
+    if os.path.exists(out_file_name):
+        with open(out_file_name) as f:
+            if f.read() == contents:
+                return 0
 
-with open(out_file_name, 'w') as f:
-    f.write(contents)
+    with open(out_file_name, 'w') as f:
+        f.write(contents)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,6 +1,8 @@
+import hashlib
 import sys
 import os
 import math
+import subprocess
 
 def createIfNeeded(path):
     if not os.path.exists(path):
@@ -8,6 +10,38 @@ def createIfNeeded(path):
             os.makedirs(os.path.dirname(path))
         open(path, 'w').close()
 
+def tool_output(args):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(args, stderr=devnull).decode('utf8', 'replace')
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def key_files(tool):
+    """Returns the tool and the files it runs or loads that hold most of the compiler."""
+    files = [os.path.realpath(tool)]
+    for prog in ('cc1plus', 'cc1'):
+        # gcc's driver is tiny, the real compiler is in these.
+        path = tool_output([tool, '-print-prog-name=' + prog]).strip()
+        if os.path.isabs(path) and os.path.exists(path):
+            files.append(os.path.realpath(path))
+    if sys.platform.startswith('linux'):
+        # clang is often linked against shared LLVM libraries.
+        for line in tool_output(['ldd', files[0]]).splitlines():
+            parts = line.split()
+            if len(parts) > 2 and parts[1] == '=>' and parts[0].startswith(('libLLVM', 'libclang')):
+                files.append(os.path.realpath(parts[2]))
+    return files
+
+def fingerprint(tool):
+    h = hashlib.sha256(tool_output([tool, '--version']).encode('utf8'))
+    for path in key_files(tool):
+        h.update(path.encode('utf8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
 def run_if_needed(base_file, then_file, now_file):
     # Python uses doubles for mtime so it can't precisely represent linux's
     # nanosecond precision. Round up to next whole second to ensure we get a
@@ -23,19 +57,38 @@ def run_if_needed(base_file, then_file, now_file):
             and os.stat(then_file).st_mtime == mtime):
         return # Don't need to do anything.
 
-    createIfNeeded(now_file)
-    os.utime(now_file, None) # None means now
+    # The mtime also changes when reinstalling the same compiler, such as during OS updates, so
+    # the then_file holds a fingerprint of the compiler and everything is only rebuilt if that
+    # changed too.
+    new_fingerprint = fingerprint(base_file)
+    old_fingerprint = None
+    if os.path.exists(then_file):
+        with open(then_file) as f:
+            old_fingerprint = f.read().strip()
 
-    createIfNeeded(then_file)
+    if not os.path.exists(now_file):
+        # This is a new tool to track, so outputs that are newer than it are up to date.
+        createIfNeeded(now_file)
+        os.utime(now_file, (atime, mtime))
+    elif new_fingerprint != old_fingerprint:
+        os.utime(now_file, None) # None means now
+
+    if new_fingerprint != old_fingerprint:
+        createIfNeeded(then_file)
+        with open(then_file, 'w') as f:
+            f.write(new_fingerprint + '\n')
     os.utime(then_file, (atime, mtime))
 
-if __name__ == '__main__':
-    if len(sys.argv) != 4:
-        print((sys.argv[0] + ': base_file then_file now_file'))
-        sys.exit(1)
+def main(argv):
+    if len(argv) != 4:
+        print((argv[0] + ': base_file then_file now_file'))
+        return 1
 
-    base_file = sys.argv[1]
-    then_file = sys.argv[2]
-    now_file = sys.argv[3]
+    base_file = argv[1]
+    then_file = argv[2]
+    now_file = argv[3]
     run_if_needed(base_file, then_file, now_file)
+    return 0
 
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# Rebuilds targets whenever the files they are built from change:
+#
+#   watch.py [--builddir dir] [--delay seconds] targets... [-- ninja_args...]
+#
+# for example `watch.py +bson_obj_test -- -j8`. Run it from the directory with build.ninja.
+#
+# The files to watch are the sources that `ninja -t inputs` lists for the targets, which needs
+# ninja >= 1.12, and the headers that .ninja_deps in the builddir says they included. Files that
+# ninja builds aren't watched. The list is refreshed after each build, so newly included headers
+# are picked up.
+#
+# A build starts once nothing has changed for --delay seconds (default 0.2). If something changes
+# while it is running, ninja is interrupted and started again. Changes are noticed with inotify on
+# Linux, or by checking mtimes every POLL_SECONDS elsewhere or when out of inotify watches.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+import ninja_log
+
+POLL_SECONDS = 1.0
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_CLOEXEC = 0o2000000
+# Editors save by writing in place, or by writing a new file and renaming it over the old one.
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct('iIII')
+
+def ninja_lines(ninja, ninja_args, *args):
+    out = subprocess.check_output([ninja] + ninja_args + list(args))
+    return out.decode('utf8').split('\0' if '-0' in args else '\n')
+
+def watched_files(ninja, ninja_args, builddir, targets):
+    """Returns the files in this tree that the targets are built from, other than outputs."""
+    inputs = set(ninja_lines(ninja, ninja_args, '-t', 'inputs', '-0', '-E', *targets))
+    deps_log = os.path.join(builddir, '.ninja_deps')
+    if os.path.exists(deps_log):
+        deps = ninja_log.read_deps(deps_log)
+        for path in list(inputs) + targets:
+            inputs.update(deps.get(path, []))
+
+    # Sources can be the outputs of no-input phony edges, such as the ones --ninja-fine-header-deps
+    # adds.
+    outputs = set(line.rsplit(': ', 1)[0]
+                  for line in ninja_lines(ninja, ninja_args, '-t', 'targets', 'all')
+                  if line.rsplit(': ', 1)[-1] != 'phony')
+    return set(os.path.normpath(path) for path in inputs
+               if path and path not in outputs and not os.path.isabs(path)
+               and not path.startswith('..') and os.path.isfile(path))
+
+class PollWatcher(object):
+    def __init__(self, files):
+        self.files = files
+        self.mtimes = self.stat()
+
+    def stat(self):
+        mtimes = {}
+        for path in self.files:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def changed(self, timeout):
+        """Returns whether any of the files changed, waiting up to timeout seconds (or forever)."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            mtimes = self.stat()
+            if mtimes != self.mtimes:
+                self.mtimes = mtimes
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(POLL_SECONDS if deadline is None
+                       else max(0, min(POLL_SECONDS, deadline - time.time())))
+
+    def close(self):
+        pass
+
+class InotifyWatcher(object):
+    """Watches the directories of the files, since editors often replace rather than write them."""
+    def __init__(self, files):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        self.names = set()
+        try:
+            for directory in set(os.path.dirname(path) or '.' for path in files):
+                wd = libc.inotify_add_watch(self.fd, directory.encode('utf8'), WATCH_MASK)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+                self.dirs[wd] = directory
+        except OSError:
+            self.close()
+            raise
+        self.names = set(os.path.normpath(path) for path in files)
+
+    def changed(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode('utf8', 'replace')
+                offset += length
+                if os.path.normpath(os.path.join(self.dirs.get(wd, ''), name)) in self.names:
+                    return True
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(files):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(files)
+        except (OSError, AttributeError) as e:
+            # Usually ENOSPC, from running out of fs.inotify.max_user_watches.
+            print('Polling for changes since inotify is unavailable: %s' % e)
+    return PollWatcher(files)
+
+def settle(watcher, delay):
+    """Waits until nothing has changed for delay seconds."""
+    while watcher.changed(delay):
+        pass
+
+def build(ninja, ninja_args, targets, watcher, delay):
+    """Runs ninja until it finishes without anything changing. Returns its exit status."""
+    while True:
+        print('\n*** Building %s' % ' '.join(targets), flush=True)
+        proc = subprocess.Popen([ninja] + ninja_args + targets)
+        while proc.poll() is None:
+            if watcher.changed(0.1):
+                # Ninja interrupts the commands it is running and keeps what they finished.
+                proc.send_signal(signal.SIGINT)
+                proc.wait()
+                print('\n*** Restarting since something changed', flush=True)
+                settle(watcher, delay)
+                break
+        else:
+            return proc.returncode
+
+def main(argv):
+    args = argv[1:]
+    ninja_args = []
+    if '--' in args:
+        ninja_args = args[args.index('--') + 1:]
+        args = args[:args.index('--')]
+    builddir = '.'
+    delay = 0.2
+    while args and args[0].startswith('--'):
+        flag = args.pop(0)
+        if flag == '--builddir' and args:
+            builddir = args.pop(0)
+        elif flag == '--delay' and args:
+            delay = float(args.pop(0))
+        else:
+            args = []
+    if not args:
+        print(argv[0] + ': [--builddir dir] [--delay seconds] targets... [-- ninja_args...]')
+        return 1
+
+    targets = args
+    ninja = os.environ.get('NINJA', 'ninja')
+    watcher = None
+    try:
+        while True:
+            files = watched_files(ninja, ninja_args, builddir, targets)
+            watcher = make_watcher(files)
+            status = build(ninja, ninja_args, targets, watcher, delay)
+            print('\n*** %s. Watching %d files for changes.' % (
+                'Done' if status == 0 else 'Failed', len(files)), flush=True)
+            watcher.changed(None)
+            settle(watcher, delay)
+            watcher.close()
+            watcher = None
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if watcher:
+            watcher.close()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))